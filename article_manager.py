@@ -1,15 +1,21 @@
-from bs4 import BeautifulSoup
 from urllib.parse import urljoin,urlparse
 import os
 from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import queue
 import re
 import yaml
-import itertools
+import functools
 import hashlib
 import logging
-import matplotlib.pyplot as plt
+import time
+from image_scheduler import ImageScheduler
+from html_parser import get_parser
+from article_processor import fill_image_placeholders, record_markup_bytes, serialize_article
+from timeout_policy import remaining
+from cover import render_cover
+from url_index import SeenIndex, canonicalize_url, content_fingerprint
 
-logging.basicConfig(level=logging.ERROR)
 logger = logging.getLogger(__name__)
 
 class Utility:
@@ -51,50 +57,52 @@ class Utility:
         return re.sub(r'[^\u4e00-\u9fa5a-zA-Z0-9.,?!]', '', text).strip().replace(' ', '-')
     
     @staticmethod
-    def generate_image_save_path(url):
+    def generate_image_save_path(url, base_dir='tmp'):
         path = urlparse(url).path
         img_url_extension = os.path.splitext(path)[1][1:]
         if not img_url_extension:
             img_url_extension = "jpg"
         img_filename = Utility.generate_filename_from_url(url, img_url_extension)
-        return os.path.join('tmp',img_filename)
+        return os.path.join(base_dir,img_filename)
 
 class ImageHandler:
-    def __init__(self, crawler, utility, max_retries=3):
+    # 图片统一交给 ImageScheduler 在整个抓取范围内并发下载、去重
+    def __init__(self, crawler, utility, max_retries=3, max_workers=64, state=None, scheduler=None, parser=None, base_dir='tmp',
+                 retry_scheduler=None):
         self.crawler = crawler
         self.utility = utility
         self.max_retries = max_retries
+        self.max_workers = max_workers
+        self.state = state
+        self.base_dir = base_dir
+        self.scheduler = scheduler if scheduler else ImageScheduler(crawler, utility, state, max_workers, max_retries, base_dir, retry_scheduler)
+        self.parser = parser if parser else get_parser()
+
+    def _image_sources(self, img_tags, base_url):
+        sources = []
+        for img_tag in img_tags:
+            img_url = self.parser.get_attr(img_tag, 'src')
+            if not img_url:
+                logger.warning(f"Image tag without src attribute found. Skipping...")
+                continue
+            sources.append((img_tag, urljoin(base_url, img_url)))
+        return sources
+
+    def _rewrite_sources(self, sources, mapping):
+        for img_tag, url in sources:
+            if url in mapping:
+                self.parser.set_attr(img_tag, 'src', mapping[url])
+
+    def download_images(self, img_tags, base_url, deadline=None):
+        """Download the images through the shared scheduler and point each tag's src at the saved file."""
+        sources = self._image_sources(img_tags, base_url)
+        mapping = self.scheduler.resolve([url for _, url in sources], deadline)
+        self._rewrite_sources(sources, mapping)
+        return mapping
 
-    def download_images(self, img_tags):
-        with ThreadPoolExecutor(max_workers=20) as executor:
-            executor.map(self.download_image, img_tags)
-    
     def download_image(self, img_tag, base_url):
-        try:
-            img_url = img_tag.get('src')
-            if not img_url: 
-                logger.warning(f"Image tag without src attribute found. Skipping...")
-                return
-            absolute_img_url = urljoin(base_url, img_url)
-            img_save_path = os.path.join(self.utility.generate_image_save_path(absolute_img_url))
-        
-            for attempt in range(self.max_retries):
-                try:
-                    if self.crawler.fetch_image(absolute_img_url, img_save_path):
-                        logger.info(f"Image downloaded from {absolute_img_url}")
-                        img_filename = os.path.basename(img_save_path)
-                        img_tag['src'] = img_filename
-                        return img_save_path
-                    else:
-                        logger.warning(f"Failed to fetch_image from {absolute_img_url}. Retrying... ({attempt + 1}/{self.max_retries})")
-                except Exception as e:
-                    logger.error(f"Failed to fetch_image from {absolute_img_url}. Error: {e}. Retrying... ({attempt + 1}/{self.max_retries})")
-                    if attempt == self.max_retries - 1:
-                        logger.error(f"Failed to download image from {absolute_img_url} after {self.max_retries} attempts. Skipping...")
-                        return
-        except Exception as e:
-            logger.error(f"Failed to fetch_image from {absolute_img_url}. Error: {e}. Skipping...")
-            return
+        mapping = self.download_images([img_tag], base_url)
+        return next(iter(mapping.values()), None)
 
     # def download_image(self, img_tag, base_url):
     #     try:
@@ -121,74 +129,173 @@ class ImageHandler:
     #     except Exception as e:
     #         logger.error(f"Failed to fetch_image. Error: {e}")
 
+    def serialize(self, element, url):
+        """Serialize element as compact XHTML and record the sampled size against prettify()."""
+        xhtml, markup_bytes = serialize_article(self.parser, element, url)
+        record_markup_bytes(self.crawler.metrics, markup_bytes)
+        return xhtml
+
+    def process_element(self, element, base_url, deadline=None):
+        """Download the images under an already parsed element and return its markup with the image files it references."""
+        mapping = self.download_images(self.parser.select(element, 'img'), base_url, deadline)
+        return self.serialize(element, base_url), sorted(set(mapping.values()))
+
+    def process_images(self, content, base_url):
+        return self.process_element(self.parser.parse(content), base_url)
+
     def handle_images_in_content(self, content, base_url):
         try:
-            soup = BeautifulSoup(content, 'html.parser')
-            for img_tag in soup.find_all('img'):
-                self.download_image(img_tag, base_url)
-            return soup.prettify()
+            return self.process_images(content, base_url)[0]
+        except Exception as e:
+            logger.error(f"Failed to download image in content. Error: {e}")
+
+    async def download_images_async(self, img_tags, base_url):
+        sources = self._image_sources(img_tags, base_url)
+        mapping = await self.scheduler.resolve_async([url for _, url in sources])
+        self._rewrite_sources(sources, mapping)
+        return mapping
+
+    async def process_element_async(self, element, base_url):
+        mapping = await self.download_images_async(self.parser.select(element, 'img'), base_url)
+        return await asyncio.to_thread(self.serialize, element, base_url), sorted(set(mapping.values()))
+
+    async def process_images_async(self, content, base_url):
+        element = await asyncio.to_thread(self.parser.parse, content)
+        return await self.process_element_async(element, base_url)
+
+    async def handle_images_in_content_async(self, content, base_url):
+        try:
+            return (await self.process_images_async(content, base_url))[0]
         except Exception as e:
             logger.error(f"Failed to download image in content. Error: {e}")
             
     def generate_book_cover(self, title, size=(1600, 2560), bg_color="white"):
-        # Create a figure and axis with desired size
-        fig, ax = plt.subplots(figsize=(size[0]/100, size[1]/100), dpi=100)
-    
-        # Set the background color
-        ax.set_facecolor(bg_color)
-        fig.patch.set_facecolor(bg_color)
-    
-        # Remove axis
-        ax.axis('off')
-    
-        # Add title text to the center of the figure
-        plt.text(0.5, 0.5, title, color=(0, 0, 0), fontsize=150, ha='center', va='center', transform=ax.transAxes)
-    
-        # Ensure the output directory exists
+        """Render a plain title cover to base_dir/cover.jpg with Pillow and return its path.
+
+        Covers are cached by title, size and colour, so rebuilding a book does not draw it again.
+        """
+        cover_path = os.path.join(self.base_dir, "cover.jpg")
         try:
-            if not os.path.exists("tmp"):
-                os.mkdir("tmp")
-            plt.savefig("tmp/cover.jpg", bbox_inches="tight", pad_inches=0, dpi=100)
-            plt.close()
+            render_cover(title, cover_path, size=size, bg_color=bg_color)
         except Exception as e:
             logger.error(f"Failed to generate book cover. Error: {e}")
+        return cover_path
 
 class TOCManager:
-    def __init__(self, crawler, utility):
+    # 章节链接先规范化再去重，各页重复的"最新章节"和只差查询参数、锚点的链接只下载一次
+    def __init__(self, crawler, utility, state=None, parser=None, base_dir='tmp', seen=None):
         self.crawler = crawler
         self.utility = utility
+        self.state = state
+        self.base_dir = base_dir
+        self.parser = parser if parser else get_parser()
+        self.seen = seen if seen else SeenIndex()
         self.toc_list = []
 
     def _generate_filename_from_url(self, url, extension):
         return self.utility.generate_filename_from_url(url, extension)
 
-    def get_toc(self, target_url, link_selector, next_page_selector=None):
+    def _resume(self, toc_url):
+        """Return (entries, next_url, encoding) to continue from, using the crawl state when available."""
+        if self.state:
+            saved = self.state.load_toc(toc_url)
+            if saved:
+                entries, page_url, next_url, encoding, complete = saved
+                if complete:
+                    # 连载中的书会在最后一页追加新章节或新的翻页链接，所以最后一页总是重新抓取
+                    logger.info(f"TOC for {toc_url} loaded from crawl state ({len(entries)} entries), checking {page_url} for new chapters")
+                    return entries, page_url or toc_url, encoding
+                logger.info(f"Resuming TOC crawl from {next_url}")
+                return entries, next_url, encoding
+        return [], toc_url, None
+
+    def parse_toc_page(self, content, page_url, link_selector, next_page_selector=None):
+        """Return the TOC entries found on one page and the URL of the next page."""
+        parser = self.parser
+        root = parser.parse(content)
+        link_tags = parser.select(root, link_selector)
+        entries = []
+        for link_tag in link_tags:
+            rel_url = parser.get_attr(link_tag, 'href')
+            if rel_url is not None:
+                chapter_url = urljoin(page_url, rel_url)
+                chapter_title = re.sub(r'[^\u4e00-\u9fa5a-zA-Z0-9.,?!_-]', '', parser.text(link_tag).strip().replace(' ', '_'))
+                filename = self._generate_filename_from_url(chapter_url, 'html')
+                entries.append({"chapter_title": chapter_title, "url": chapter_url, "filename": filename})
+        next_url = None
+        if next_page_selector:
+            next_page = parser.select_one(root, next_page_selector)
+            next_href = parser.get_attr(next_page, 'href') if next_page is not None else None
+            if next_href is not None:
+                next_url = urljoin(page_url, next_href)
+        return entries, next_url
+
+    def _dedupe(self, entries):
+        """Drop entries whose URL is already in the TOC, comparing canonical forms of the URLs."""
+        unique = [entry for entry in entries if self.seen.add(canonicalize_url(entry['url']))]
+        if len(unique) < len(entries):
+            self.crawler.metrics.incr('toc_duplicates', len(entries) - len(unique))
+            logger.info(f"Skipped {len(entries) - len(unique)} duplicate chapter links")
+        return unique
+
+    def _record_page(self, toc_url, page_url, entries, next_url, encoding):
+        self.toc_list.extend(entries)
+        if self.state:
+            self.state.add_toc_page(toc_url, page_url, entries, next_url, encoding)
+
+    def iter_toc(self, target_url, link_selector, next_page_selector=None):
+        """Yield (entries, encoding) for each TOC page as soon as it is parsed."""
+        toc_url = target_url
+        entries, target_url, encoding = self._resume(toc_url)
+        entries = self._dedupe(entries)
+        if entries:
+            self.toc_list.extend(entries)
+            yield entries, encoding
+
         while target_url:
             logger.info(f"Crawling TOC from {target_url}")
-            html = self.crawler.fetch(target_url)
-            content = html["content"]
-            encoding = html["encoding"]
-            self.save_toc_html_to_file(content, encoding)
-            if not html:
-                logger.error(f"Failed to fetch {target_url}. Skipping...")
-                continue
-            soup = BeautifulSoup(content, 'html.parser')
-            link_tags = soup.select(link_selector)
-            for link_tag in link_tags:
-                if 'href' in link_tag.attrs:
-                    rel_url = link_tag['href']
-                    chapter_url = urljoin(target_url, rel_url).strip()
-                    chapter_title = re.sub(r'[^\u4e00-\u9fa5a-zA-Z0-9.,?!_-]', '', link_tag.text.strip().replace(' ', '_'))
-                    filename = self._generate_filename_from_url(chapter_url, 'html')
-                    self.toc_list.append({"chapter_title": chapter_title, "url": chapter_url, "filename": filename})
-            if next_page_selector:
-                next_page = soup.select_one(next_page_selector)
-                if next_page and 'href' in next_page.attrs: 
-                    target_url = urljoin(target_url, next_page['href'])
-                else:
-                    target_url = None
-            else:
-                break
+            with self.crawler.metrics.timer('toc'):
+                html = self.crawler.fetch(target_url)
+                if not html:
+                    logger.error(f"Failed to fetch {target_url}. Stopping TOC crawl...")
+                    break
+                content = html["content"]
+                encoding = html["encoding"]
+                self.save_toc_html_to_file(content, encoding, self.base_dir)
+                entries, next_url = self.parse_toc_page(content, target_url, link_selector, next_page_selector)
+                entries = self._dedupe(entries)
+                self._record_page(toc_url, target_url, entries, next_url, encoding)
+            yield entries, encoding
+            target_url = next_url
+
+    async def iter_toc_async(self, target_url, link_selector, next_page_selector=None):
+        toc_url = target_url
+        entries, target_url, encoding = self._resume(toc_url)
+        entries = self._dedupe(entries)
+        if entries:
+            self.toc_list.extend(entries)
+            yield entries, encoding
+
+        while target_url:
+            logger.info(f"Crawling TOC from {target_url}")
+            with self.crawler.metrics.timer('toc'):
+                html = await self.crawler.afetch(target_url)
+                if not html:
+                    logger.error(f"Failed to fetch {target_url}. Stopping TOC crawl...")
+                    break
+                content = html["content"]
+                encoding = html["encoding"]
+                self.save_toc_html_to_file(content, encoding, self.base_dir)
+                entries, next_url = await asyncio.to_thread(self.parse_toc_page, content, target_url, link_selector, next_page_selector)
+                entries = self._dedupe(entries)
+                self._record_page(toc_url, target_url, entries, next_url, encoding)
+            yield entries, encoding
+            target_url = next_url
+
+    def get_toc(self, target_url, link_selector, next_page_selector=None):
+        encoding = None
+        for _, encoding in self.iter_toc(target_url, link_selector, next_page_selector):
+            pass
         return {"toc":self.toc_list, "encoding": encoding}
     
     def save_toc_html_to_file(self, html, encoding, base_dir='tmp'):
@@ -208,10 +315,27 @@ class TOCManager:
 
 class ArticleDownloader:
     
-    def __init__(self, crawler, utility, image_handler):
+    def __init__(self, crawler, utility, image_handler, state=None, image_manifest=None, processor=None, article_timeout=120,
+                 dedupe_content=False, store=None, retry_scheduler=None):
         self.crawler = crawler
         self.utility = utility
         self.image_handler = image_handler
+        self.state = state
+        self.image_manifest = image_manifest
+        self.parser = image_handler.parser
+        self.metrics = crawler.metrics
+        # 每篇文章（页面、解析、图片）的总时限，超时后真正停止等待而不是留在后台继续占用线程
+        self.article_timeout = article_timeout
+        # 设置了 processor 时解析和清理在进程池中进行，线程只负责网络 I/O
+        self.processor = processor
+        # 开启后正文与之前某章完全相同的章节不再保存，也不会进入 EPUB
+        self.fingerprints = SeenIndex() if dedupe_content else None
+        self.duplicate_files = set()
+        # 设置了 store（PackStore）时章节写入同一个打包文件，不再每章一个文件
+        self.store = store
+        # 设置了 retry_scheduler 时请求失败不在本线程中重试，章节交给延迟队列稍后重新下载
+        self.retry_scheduler = retry_scheduler
+        self.fetch_options = {'retries': 0} if retry_scheduler else {}
 
     def resolve_url(self, base_url, img_rel_url):
         if img_rel_url.startswith("//"):
@@ -258,56 +382,214 @@ class ArticleDownloader:
     #     return {"content": article, "encoding": encoding}
 
 
-    def fetch_article(self, url, article_selector, remove_selectors):
-        logger.info(f"Fetching article from {url}...")
-        html = self.crawler.fetch(url)
-        content = html["content"]
-        encoding = html["encoding"]
-        if not html:
+    def _fetch_failed(self, url):
+        # 有 retry_scheduler 时这次失败稍后还会重试（延迟队列或分布式的共享队列），最终失败由调用方记录为错误
+        if self.retry_scheduler:
+            logger.warning(f"Failed to fetch article content from {url}.")
+        else:
             logger.error(f"Failed to fetch article content from {url}. Skipping...")
-            return None
 
+    def _valid_selector(self, url, article_selector):
         # Check if the selector is valid
         if not article_selector or not isinstance(article_selector, str) or len(article_selector.strip()) == 0:
             error_message = f"Invalid or empty CSS selector provided for {url}. Please provide a valid selector."
             logger.error(error_message)
+            return False
+        return True
+
+    def extract_article(self, content, url, article_selector, remove_selectors):
+        """Parse the page and return the article element, or None if it cannot be selected."""
+        if not self._valid_selector(url, article_selector):
             return None
 
-        soup = BeautifulSoup(content, 'html.parser')
+        root = self.parser.parse(content)
 
         if remove_selectors:
             try:
                 for selector in remove_selectors:
                     if selector:
-                        for elem in soup.select(selector.strip()):
-                            elem.extract()
+                        for elem in self.parser.select(root, selector.strip()):
+                            self.parser.remove(elem)
             except Exception as e:
                 logger.error(f"Error removing elements with selector '{selector}': {e}")
 
+        article_element = self.parser.select_one(root, article_selector)
+        if article_element is None:
+            logger.error(f"Failed to fetch article content from {url}. Returning the raw content.")
+        return article_element
+
+    def _processed_result(self, cleaned, mapping):
+        record_markup_bytes(self.metrics, cleaned["markup_bytes"])
+        content = fill_image_placeholders(cleaned["content"], cleaned["image_urls"], mapping)
+        return {"content": content, "encoding": cleaned["encoding"], "images": sorted(set(mapping.values()))}
+
+    def _raw_result(self, raw, url, error):
+        logger.error(f"Error while processing article from {url}. Error: {error}")
+        return {"content": raw["content"].decode(raw["encoding"], errors='replace'), "encoding": raw["encoding"], "images": []}
+
+    def _submit(self, raw, url, article_selector, remove_selectors):
+        future = self.processor.submit(raw["content"], raw["encoding"], url, article_selector, remove_selectors)
+        self.metrics.queue_depth('process', self.processor.pending)
+        future.add_done_callback(lambda _: self.metrics.queue_depth('process', self.processor.pending))
+        return future
+
+    def fetch_article_processed(self, url, article_selector, remove_selectors, deadline=None):
+        """I/O stage: download the raw page, clean it in the process pool, then download its images."""
+        logger.info(f"Fetching article from {url}...")
+        with self.metrics.timer('fetch'):
+            raw = self.crawler.fetch_raw(url, deadline=deadline, **self.fetch_options)
+        if raw is None:
+            self._fetch_failed(url)
+            return None
+        if not self._valid_selector(url, article_selector):
+            return None
         try:
-            article_element = soup.select_one(article_selector)
-            if article_element:
-                article = self.image_handler.handle_images_in_content(article_element.prettify(), url)
+            with self.metrics.timer('parse'):
+                cleaned = self._submit(raw, url, article_selector, remove_selectors).result(timeout=remaining(deadline))
+            mapping = self.image_handler.scheduler.resolve(cleaned["image_urls"].values(), deadline)
+            return self._processed_result(cleaned, mapping)
+        except TimeoutError:
+            raise
+        except Exception as e:
+            return self._raw_result(raw, url, e)
+
+    async def fetch_article_processed_async(self, url, article_selector, remove_selectors):
+        logger.info(f"Fetching article from {url}...")
+        with self.metrics.timer('fetch'):
+            raw = await self.crawler.afetch_raw(url, **self.fetch_options)
+        if raw is None:
+            self._fetch_failed(url)
+            return None
+        if not self._valid_selector(url, article_selector):
+            return None
+        try:
+            with self.metrics.timer('parse'):
+                cleaned = await asyncio.wrap_future(self._submit(raw, url, article_selector, remove_selectors))
+            mapping = await self.image_handler.scheduler.resolve_async(cleaned["image_urls"].values())
+            return self._processed_result(cleaned, mapping)
+        except Exception as e:
+            return self._raw_result(raw, url, e)
+
+    def fetch_article(self, url, article_selector, remove_selectors, deadline=None):
+        if self.processor:
+            return self.fetch_article_processed(url, article_selector, remove_selectors, deadline)
+        logger.info(f"Fetching article from {url}...")
+        with self.metrics.timer('fetch'):
+            html = self.crawler.fetch(url, deadline=deadline, **self.fetch_options)
+        if not html:
+            self._fetch_failed(url)
+            return None
+        content = html["content"]
+        encoding = html["encoding"]
+        images = []
+
+        try:
+            with self.metrics.timer('parse'):
+                article_element = self.extract_article(content, url, article_selector, remove_selectors)
+            if article_element is not None:
+                # 直接处理已解析的元素，每篇文章只解析一次
+                article, images = self.image_handler.process_element(article_element, url, deadline)
             else:
                 article = content
-                logger.error(f"Failed to fetch article content from {url}. Returning the raw content.")
+        except TimeoutError:
+            raise
         except Exception as e:
             logger.error(f"Error while processing article from {url}. Error: {e}")
             article = content  # 如果处理文章中的图片或其他内容时出错，仍然返回基本内容
 
-        return {"content": article, "encoding": encoding}
+        return {"content": article, "encoding": encoding, "images": images}
+
+    async def fetch_article_async(self, url, article_selector, remove_selectors):
+        if self.processor:
+            return await self.fetch_article_processed_async(url, article_selector, remove_selectors)
+        logger.info(f"Fetching article from {url}...")
+        with self.metrics.timer('fetch'):
+            html = await self.crawler.afetch(url, **self.fetch_options)
+        if not html:
+            self._fetch_failed(url)
+            return None
+        content = html["content"]
+        encoding = html["encoding"]
+        images = []
+
+        try:
+            # 解析是 CPU 密集操作，放到线程中执行以免阻塞事件循环
+            with self.metrics.timer('parse'):
+                article_element = await asyncio.to_thread(self.extract_article, content, url, article_selector, remove_selectors)
+            if article_element is not None:
+                article, images = await self.image_handler.process_element_async(article_element, url)
+            else:
+                article = content
+        except Exception as e:
+            logger.error(f"Error while processing article from {url}. Error: {e}")
+            article = content
+
+        return {"content": article, "encoding": encoding, "images": images}
 
     def save_article(self, url, content ,encoding, base_dir="tmp"):
         file_name = self.utility.generate_filename_from_url(url, 'html')
+        if self.store is not None:
+            try:
+                self.store.put(file_name, content)
+                logger.info(f"Article saved to {self.store.path} as {file_name}")
+                return file_name
+            except Exception as e:
+                logger.error(f"Failed to save article to {self.store.path}. Error: {e}")
+                return None
         file_path = os.path.join(base_dir, file_name)
         os.makedirs(base_dir, exist_ok=True)
         try:
-            with open(file_path, 'w', encoding=encoding) as file:
+            # 内容已经解码为文本，统一按 UTF-8 保存，EpubGenerator 也按 UTF-8 读取
+            with open(file_path, 'w', encoding='utf-8') as file:
                 file.write(content)
             logger.info(f"Article saved to {file_path}")
+            return file_name
         except Exception as e:
             logger.error(f"Failed to save article to {file_path}. Error: {e}")
 
+    def restore_fingerprints(self, done):
+        """Load the fingerprints of chapters finished in earlier runs, so content dedupe carries over a resume.
+
+        done is the set of URLs that are not downloaded again.
+        """
+        if self.fingerprints is None or not self.state:
+            return
+        for url, fingerprint, duplicate in self.state.fingerprints():
+            if url not in done:
+                continue
+            if duplicate:
+                self.duplicate_files.add(self.utility.generate_filename_from_url(url, 'html'))
+            else:
+                self.fingerprints.add(fingerprint)
+
+    def _store_article(self, url, html, base_dir):
+        fingerprint = content_fingerprint(html["content"]) if self.fingerprints is not None else None
+        if fingerprint is not None and not self.fingerprints.add(fingerprint):
+            file_name = self.utility.generate_filename_from_url(url, 'html')
+            logger.info(f"Article from {url} duplicates an earlier chapter. Skipping...")
+            self.duplicate_files.add(file_name)
+            self.metrics.incr('chapters_duplicate')
+            if self.state:
+                self.state.record_fingerprint(url, fingerprint, duplicate=True)
+            self._record_result(url, file_name)
+            return
+        with self.metrics.timer('save'):
+            file_name = self.save_article(url, html["content"], html["encoding"], base_dir)
+        if file_name and self.image_manifest:
+            self.image_manifest.record(file_name, html.get("images", []))
+        if file_name and fingerprint is not None and self.state:
+            self.state.record_fingerprint(url, fingerprint)
+        self._record_result(url, file_name)
+
+    def _record_result(self, url, file_name, error=None):
+        self.metrics.incr('chapters_done' if file_name else 'chapters_failed')
+        if not self.state:
+            return
+        if file_name:
+            self.state.mark_done(url, file_name)
+        else:
+            self.state.mark_failed(url, error or "download failed")
+
     # def download_and_save(self, url, article_selector, remove_selectors, base_dir="tmp"):
     #     try:
     #         html = self.fetch_article(url, article_selector, remove_selectors)
@@ -321,53 +603,259 @@ class ArticleDownloader:
     #         logger.error(error_message)
     #         return error_message
     
-    def download_and_save(self, url, article_selector, remove_selectors, base_dir="tmp"):
-            try:
-                with ThreadPoolExecutor(max_workers=1) as executor:
-                    future = executor.submit(self.fetch_article, url, article_selector, remove_selectors)
-                    html = future.result(timeout=10)  # 设置10秒的超时时间
-                
-                    if html:
-                        logger.info(f"从 {url} 获取到了文章数据。正在保存到文件中...")
-                        self.save_article(url, html["content"], html["encoding"], base_dir)
-                    else:
-                        logger.error(f"无法从 {url} 获取文章数据。跳过...")
-            except TimeoutError:
-                logger.error(f"从 {url} 下载文章超出了10秒。中断下载并跳过这篇文章...")
-            except Exception as e:
-                error_message = f"从 {url} 下载并保存文章时发生了错误。错误: {e}"
-                logger.error(error_message)
-                return error_message
+    def download_and_save(self, url, article_selector, remove_selectors, base_dir="tmp", resubmit=None):
+        """Download, clean and save one chapter. When it fails and resubmit is given, the retry
+        scheduler may call resubmit() later to queue the chapter again instead of recording the failure."""
+        if self.state:
+            self.state.mark_started(url)
+        # 截止时间传给每个请求和等待，超时后本线程立即放弃这篇文章
+        deadline = time.monotonic() + self.article_timeout
+        try:
+            html = self.fetch_article(url, article_selector, remove_selectors, deadline)
+            if not html and remaining(deadline) == 0:
+                raise TimeoutError(url)
+            if html:
+                logger.info(f"从 {url} 获取到了文章数据。正在保存到文件中...")
+                self._store_article(url, html, base_dir)
+            elif not self._retry(url, resubmit):
+                logger.error(f"无法从 {url} 获取文章数据。跳过...")
+                self._record_result(url, None)
+        except TimeoutError:
+            if not self._retry(url, resubmit):
+                self._article_timed_out(url)
+        except Exception as e:
+            error_message = f"从 {url} 下载并保存文章时发生了错误。错误: {e}"
+            logger.error(error_message)
+            self._record_result(url, None, e)
+            return error_message
+
+    def _retry(self, url, resubmit):
+        if resubmit is None or self.retry_scheduler is None or not self.retry_scheduler.defer(url, resubmit):
+            return False
+        logger.warning(f"从 {url} 下载文章失败，稍后重试...")
+        return True
+
+    def _article_timed_out(self, url):
+        logger.error(f"从 {url} 下载文章超出了{self.article_timeout}秒。中断下载并跳过这篇文章...")
+        self.metrics.incr('article_timeouts')
+        self._record_result(url, None, "timeout")
+
+    async def download_and_save_async(self, url, article_selector, remove_selectors, base_dir="tmp", resubmit=None):
+        if self.state:
+            self.state.mark_started(url)
+        try:
+            # wait_for 超时会取消整篇文章的协程，在途请求随之关闭
+            html = await asyncio.wait_for(self.fetch_article_async(url, article_selector, remove_selectors), self.article_timeout)
+            if html:
+                logger.info(f"从 {url} 获取到了文章数据。正在保存到文件中...")
+                self._store_article(url, html, base_dir)
+            elif not self._retry(url, resubmit):
+                logger.error(f"无法从 {url} 获取文章数据。跳过...")
+                self._record_result(url, None)
+        except asyncio.TimeoutError:
+            if not self._retry(url, resubmit):
+                self._article_timed_out(url)
+        except Exception as e:
+            error_message = f"从 {url} 下载并保存文章时发生了错误。错误: {e}"
+            logger.error(error_message)
+            self._record_result(url, None, e)
+            return error_message
 
 
 class ArticleManager:
-    def __init__(self, toc_manager, article_downloader):
+    # 线程数只是上限，真正的并发由 crawler 的 rate_limiter 按 host 控制
+    def __init__(self, toc_manager, article_downloader, max_workers=64):
         self.toc_manager = toc_manager
         self.article_downloader = article_downloader
+        self.max_workers = max_workers
     
     def generate_and_save_toc(self, target_url, link_selector, next_page_selector=None, base_dir='tmp'):
         toc_data = self.toc_manager.get_toc(target_url, link_selector, next_page_selector)
         toc = toc_data["toc"]
-        toc_encoding = toc_data["encoding"]
+        self.save_toc(toc, toc_data["encoding"], base_dir)
+        return toc
+
+    def save_toc(self, toc, toc_encoding, base_dir='tmp'):
         toc_filepath = os.path.join(base_dir, "toc.yaml")
         os.makedirs(base_dir, exist_ok=True)
         with open(toc_filepath, 'w', encoding=toc_encoding) as f:
             yaml.dump(toc, f, allow_unicode=True)
         logger.info(f"TOC saved to {toc_filepath}")
-        return toc
 
-    def download_articles(self, toc, article_selector, base_dir='tmp'):
+    def download_articles(self, toc, article_selector, remove_selectors=None, base_dir='tmp'):
         logger.info(f"Starting to download articles... Total articles: {len(toc)}")
+        state = self.article_downloader.state
+        if state:
+            done = state.done_urls(base_dir, self.article_downloader.store)
+            self.article_downloader.restore_fingerprints(done)
+            toc = [entry for entry in toc if entry["url"] not in done]
+            logger.info(f"{len(toc)} articles left to download after checking the crawl state")
         urls = [chapter['url'] for chapter in toc]
         if not urls:
             logger.warning("No URLs found in TOC. Skipping article download.")
             return
 
-        with ThreadPoolExecutor(max_workers=20) as executor:
-            results = executor.map(self.article_downloader.download_and_save, urls,
-                        itertools.repeat(article_selector), 
-                        itertools.repeat(base_dir))
-        # Check if any exceptions occurred in the threads
-        for result in results:
-            if result:
-                logger.error(f"Error occurred while downloading an article: {result}")
\ No newline at end of file
+        crawler = self.article_downloader.crawler
+        if crawler.is_async:
+            crawler.run(self.download_articles_async(urls, article_selector, remove_selectors, base_dir))
+        else:
+            self._download_threads([[{'url': url} for url in urls]], article_selector, remove_selectors, base_dir)
+        self._save_image_manifest()
+
+    def _save_image_manifest(self):
+        if self.article_downloader.image_manifest:
+            self.article_downloader.image_manifest.save()
+
+    async def download_articles_async(self, urls, article_selector, remove_selectors=None, base_dir='tmp'):
+        async def batches():
+            yield [{'url': url} for url in urls]
+        await self._download_async(batches(), article_selector, remove_selectors, base_dir)
+
+    def _wait_for_retries(self, chapters):
+        """Wait until the queue is empty and no chapter is waiting for a retry, then run the final retry pass."""
+        retry_scheduler = self.article_downloader.retry_scheduler
+        while True:
+            chapters.join()
+            if retry_scheduler is None:
+                return
+            if retry_scheduler.pending:
+                retry_scheduler.wait_idle()
+            elif not retry_scheduler.final_pass():
+                return
+
+    async def _wait_for_retries_async(self, chapters):
+        retry_scheduler = self.article_downloader.retry_scheduler
+        while True:
+            await chapters.join()
+            if retry_scheduler is None:
+                return
+            if retry_scheduler.pending:
+                await asyncio.to_thread(retry_scheduler.wait_idle)
+            elif not retry_scheduler.final_pass():
+                return
+
+    def download_pipelined(self, target_url, link_selector, next_page_selector, article_selector,
+                           remove_selectors=None, base_dir='tmp', queue_size=1000):
+        """Crawl the TOC and download chapters at the same time.
+
+        Chapter URLs are handed to the download workers as soon as their TOC page is parsed.
+        The queue is bounded so TOC crawling waits when the workers fall behind. Returns the
+        TOC in page order, which is also saved to toc.yaml.
+        """
+        state = self.article_downloader.state
+        done = state.done_urls(base_dir, self.article_downloader.store) if state else set()
+        self.article_downloader.restore_fingerprints(done)
+        crawler = self.article_downloader.crawler
+        if crawler.is_async:
+            toc, encoding = crawler.run(self._download_pipelined_async(
+                target_url, link_selector, next_page_selector, article_selector, remove_selectors, base_dir, queue_size, done))
+        else:
+            toc, encoding = self._download_pipelined_threads(
+                target_url, link_selector, next_page_selector, article_selector, remove_selectors, base_dir, queue_size, done)
+        self.save_toc(toc, encoding, base_dir)
+        self._save_image_manifest()
+        return toc
+
+    def _download_pipelined_threads(self, target_url, link_selector, next_page_selector, article_selector,
+                                    remove_selectors, base_dir, queue_size, done):
+        toc = []
+        encoding = None
+
+        def batches():
+            nonlocal encoding
+            for entries, encoding in self.toc_manager.iter_toc(target_url, link_selector, next_page_selector):
+                toc.extend(entries)
+                yield [entry for entry in entries if entry['url'] not in done]
+
+        self._download_threads(batches(), article_selector, remove_selectors, base_dir, queue_size)
+        return toc, encoding
+
+    def _download_threads(self, batches, article_selector, remove_selectors, base_dir, queue_size=1000):
+        """Download the chapters of each batch of TOC entries with max_workers threads.
+
+        Failed chapters are put back on the queue by the retry scheduler after their backoff;
+        this returns once every chapter has been saved or given up on.
+        """
+        chapters = queue.Queue(maxsize=queue_size)
+        metrics = self.article_downloader.metrics
+
+        def worker():
+            while True:
+                entry = chapters.get()
+                metrics.queue_depth('chapters', chapters.qsize())
+                if entry is None:
+                    return
+                try:
+                    result = self.article_downloader.download_and_save(entry['url'], article_selector, remove_selectors, base_dir,
+                                                                       resubmit=functools.partial(chapters.put, entry))
+                    if result:
+                        logger.error(f"Error occurred while downloading an article: {result}")
+                finally:
+                    chapters.task_done()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for _ in range(self.max_workers):
+                executor.submit(worker)
+            try:
+                for entries in batches:
+                    for entry in entries:
+                        metrics.incr('chapters_queued')
+                        chapters.put(entry)
+                        metrics.queue_depth('chapters', chapters.qsize())
+                self._wait_for_retries(chapters)
+            finally:
+                for _ in range(self.max_workers):
+                    chapters.put(None)
+
+    async def _download_pipelined_async(self, target_url, link_selector, next_page_selector, article_selector,
+                                        remove_selectors, base_dir, queue_size, done):
+        toc = []
+        encoding = None
+
+        async def batches():
+            nonlocal encoding
+            async for entries, encoding in self.toc_manager.iter_toc_async(target_url, link_selector, next_page_selector):
+                toc.extend(entries)
+                yield [entry for entry in entries if entry['url'] not in done]
+
+        await self._download_async(batches(), article_selector, remove_selectors, base_dir, queue_size)
+        return toc, encoding
+
+    async def _download_async(self, batches, article_selector, remove_selectors, base_dir, queue_size=1000):
+        # 并发度由 AsyncCrawler 的 concurrency 控制
+        chapters = asyncio.Queue(maxsize=queue_size)
+        metrics = self.article_downloader.metrics
+        workers = self.article_downloader.crawler.concurrency
+        loop = asyncio.get_running_loop()
+
+        def resubmit(entry):
+            # 在 RetryScheduler 的线程中调用，等章节真正放回队列后才返回
+            asyncio.run_coroutine_threadsafe(chapters.put(entry), loop).result()
+
+        async def produce():
+            try:
+                async for entries in batches:
+                    for entry in entries:
+                        metrics.incr('chapters_queued')
+                        await chapters.put(entry)
+                        metrics.queue_depth('chapters', chapters.qsize())
+                await self._wait_for_retries_async(chapters)
+            finally:
+                for _ in range(workers):
+                    await chapters.put(None)
+
+        async def consume():
+            while True:
+                entry = await chapters.get()
+                metrics.queue_depth('chapters', chapters.qsize())
+                if entry is None:
+                    return
+                try:
+                    result = await self.article_downloader.download_and_save_async(entry['url'], article_selector, remove_selectors, base_dir,
+                                                                                   resubmit=functools.partial(resubmit, entry))
+                    if result:
+                        logger.error(f"Error occurred while downloading an article: {result}")
+                finally:
+                    chapters.task_done()
+
+        await asyncio.gather(produce(), *(consume() for _ in range(workers)))
@@ -0,0 +1,251 @@
+import asyncio
+import logging
+import threading
+import time
+import aiohttp
+from crawler import Crawler, random_user_agent
+from encoding import EncodingResolver
+from metrics import Metrics
+from timeout_policy import TimeoutPolicy, remaining
+from http_transport import reuse_stats
+from retry_scheduler import RetryBudget
+from proxy_manager import ProxyManager
+from rate_limiter import AsyncRateLimiter, classify_status, THROTTLED, ERROR
+
+logger = logging.getLogger(__name__)
+
+class AsyncCrawler:
+    """asyncio 版本的 Crawler。
+
+    网络请求全部在一个后台事件循环里执行，`concurrency` 控制同时在途的请求数。
+    `fetch` / `fetch_image` 与 Crawler 的同步接口保持一致（可在任意非事件循环线程中调用），
+    `afetch` / `afetch_image` 供协程直接 await。
+    """
+
+    is_async = True
+
+    def __init__(self, proxy_pool_url=None, max_retries=3, concurrency=200, timeout=(5, 10), rate_limiter=None, cache=None, proxy_manager=None, metrics=None, timeout_policy=None,
+                 limit_per_host=0, keepalive_timeout=60, retry_budget=None):
+        self.proxy_pool_url = proxy_pool_url
+        if proxy_manager is None and proxy_pool_url:
+            proxy_manager = ProxyManager(proxy_pool_url)
+        self.proxy_manager = proxy_manager
+        self.max_retries = max_retries
+        self.concurrency = concurrency
+        self.rate_limiter = rate_limiter if rate_limiter else AsyncRateLimiter()
+        self.cache = cache
+        self.encoding_resolver = EncodingResolver()
+        self.metrics = metrics if metrics else Metrics()
+        # timeout 是还没有足够耗时样本时使用的初始值，之后按 host 自适应
+        self.timeout_policy = timeout_policy if timeout_policy else TimeoutPolicy(default=timeout)
+        self.timeout = aiohttp.ClientTimeout(sock_connect=timeout[0], sock_read=timeout[1])
+        self.failed_requests = []
+        self.retry_budget = retry_budget if retry_budget else RetryBudget()
+        # 0 表示单个 host 可以用满 concurrency 个连接；空闲连接保留 keepalive_timeout 秒供后续请求复用
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.connection_counts = {"requests": 0, "connections": 0}
+        self.metrics.add_collector(self.connection_stats)
+        self.metrics.add_collector(self.encoding_resolver.stats)
+        self.metrics.add_collector(self.rate_limiter.stats)
+        self.metrics.add_collector(self.timeout_policy.stats)
+        if self.proxy_manager:
+            self.metrics.add_collector(self.proxy_manager.stats)
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self._thread.start()
+        self.session = None
+        self._semaphore = None
+        self.run(self._setup())
+
+    async def _setup(self):
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.limit_per_host,
+                                         keepalive_timeout=self.keepalive_timeout)
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_end.append(self._count('requests'))
+        trace_config.on_connection_create_end.append(self._count('connections'))
+        self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout, trace_configs=[trace_config])
+
+    def _count(self, name):
+        # 回调都在事件循环线程中执行，不需要加锁
+        async def count(session, context, params):
+            self.connection_counts[name] += 1
+        return count
+
+    def connection_stats(self):
+        """Keep-alive reuse gauges: requests sent, connections opened and the share of requests that reused a connection."""
+        return reuse_stats(dict(self.connection_counts))
+
+    def run(self, coro):
+        """在后台事件循环中执行协程并阻塞等待结果，不能在事件循环线程内调用。"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def close(self):
+        if self.session:
+            self.run(self.session.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+
+    def _wait_time(self, attempt, backoff_factor=2):
+        return backoff_factor ** attempt
+
+    async def _get_proxy(self):
+        if self.proxy_manager:
+            # 代理池为空时 get 会阻塞等待补充，放到线程中执行
+            return await asyncio.to_thread(self.proxy_manager.get)
+        return None
+
+    async def _request(self, method, url, handler, **kwargs):
+        headers = kwargs.pop('headers', {})
+        headers['User-Agent'] = random_user_agent()
+        deadline = kwargs.pop('deadline', None)
+        retries = kwargs.pop('retries', None)
+        max_retries = self.max_retries if retries is None else retries
+
+        for attempt in range(max_retries + 1):
+            connect_timeout, read_timeout = self.timeout_policy.timeout(url, deadline)
+            if min(connect_timeout, read_timeout) <= 0:
+                return self._request_failed(url, "deadline exceeded")
+            proxy_address = await self._get_proxy()
+            proxy = 'http://' + proxy_address if proxy_address else None
+            # concurrency 是全局上限，rate_limiter 再按 host 自适应收紧
+            token = await self.rate_limiter.acquire(url)
+            self.retry_budget.record_request()
+            request_timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+            outcome = ERROR
+            proxy_ok = False
+            status = 'error'
+            started = time.monotonic()
+            try:
+                async with self._semaphore:
+                    # 等待信号量的时间不计入耗时，否则并发高时超时会被无谓放大
+                    started = time.monotonic()
+                    async with self.session.request(method, url, headers=headers, proxy=proxy, timeout=request_timeout, **kwargs) as response:
+                        outcome = classify_status(response.status)
+                        status = response.status
+                        self.timeout_policy.observe(url, time.monotonic() - started)
+                        proxy_ok = response.status not in Crawler.PROXY_FAILURE_STATUS_CODES
+                        response.raise_for_status()
+                        if self.failed_requests:
+                            self._recovered(url)
+                        return await handler(response)
+            except asyncio.TimeoutError as e:
+                outcome = THROTTLED
+                status = 'timeout'
+                self.timeout_policy.timed_out(url)
+                error = e
+            except aiohttp.ClientError as e:
+                error = e
+            finally:
+                await self.rate_limiter.release(token, outcome)
+                self.metrics.observe_request(url, status, time.monotonic() - started)
+                if self.proxy_manager:
+                    self.proxy_manager.report(proxy_address, proxy_ok, time.monotonic() - started)
+
+            if attempt == max_retries:
+                return self._request_failed(url, error, deferred=retries == 0)
+            wait_time = self._wait_time(attempt)
+            left = remaining(deadline)
+            if left is not None and wait_time >= left:
+                return self._request_failed(url, f"deadline exceeded after {attempt + 1} attempts: {error!r}")
+            if not self.retry_budget.spend():
+                self.metrics.incr('retries_denied')
+                return self._request_failed(url, f"retry budget exhausted: {error!r}")
+            self.metrics.incr('retries')
+            logger.info(f"Retrying in {wait_time}s...")
+            await asyncio.sleep(wait_time)
+
+    def _request_failed(self, url, error, deferred=False):
+        self.failed_requests.append((url, str(error) or type(error).__name__))
+        self.metrics.incr('failed_requests')
+        log = logger.warning if deferred else logger.error
+        log(f"Request failed for URL: {url} with error: {error!r}")
+        return None
+
+    def _recovered(self, url):
+        # 延迟重试后成功的 URL 不再算作失败；只在事件循环线程中调用，不需要加锁
+        self.failed_requests[:] = [(failed_url, error) for failed_url, error in self.failed_requests if failed_url != url]
+
+    def _cache_lookup(self, url, kwargs):
+        """Return the cache entry for url and add conditional headers to kwargs when it needs revalidation."""
+        entry = self.cache.get(url) if self.cache else None
+        if entry and not self.cache.is_fresh(entry):
+            kwargs['headers'] = {**kwargs.get('headers', {}), **self.cache.conditional_headers(entry)}
+        return entry
+
+    def _not_modified(self, response, entry):
+        if response.status == 304 and entry:
+            self.cache.refresh(entry, response.headers)
+            self.cache.hit(entry, revalidated=True)
+            return True
+        return False
+
+    async def afetch_raw(self, url, **kwargs):
+        entry = self._cache_lookup(url, kwargs)
+
+        async def read_body(response):
+            if self._not_modified(response, entry):
+                return self.cache.read(entry), entry["content_type"]
+            body = await response.read()
+            self.metrics.add_bytes(url, len(body))
+            if self.cache:
+                self.cache.store(url, body, response.headers)
+            return body, response.headers.get('Content-Type')
+
+        try:
+            if entry and self.cache.is_fresh(entry):
+                self.cache.hit(entry)
+                result = self.cache.read(entry), entry["content_type"]
+            else:
+                result = await self._request('GET', url, read_body, **kwargs)
+            if result is None:
+                return None
+            body, content_type = result
+            return {"content": body, "encoding": self.encoding_resolver.resolve(body, content_type, url)}
+        except Exception as e:
+            logger.error(f"Failed to fetch {url}. Error: {e}")
+            return None
+
+    async def afetch(self, url, **kwargs):
+        raw = await self.afetch_raw(url, **kwargs)
+        if raw is None:
+            return None
+        return {"content": raw["content"].decode(raw["encoding"], errors='replace'), "encoding": raw["encoding"]}
+
+    async def afetch_image(self, url, save_path, **kwargs):
+        entry = self._cache_lookup(url, kwargs)
+
+        async def save(response):
+            if self._not_modified(response, entry):
+                self.cache.copy_to(entry, save_path)
+                return True
+            with open(save_path, 'wb') as file:
+                async for chunk in response.content.iter_chunked(8192):
+                    file.write(chunk)
+                    self.metrics.add_bytes(url, len(chunk))
+            if self.cache:
+                self.cache.store_file(url, save_path, response.headers)
+            return True
+
+        if entry and self.cache.is_fresh(entry):
+            self.cache.hit(entry)
+            self.cache.copy_to(entry, save_path)
+            return True
+        result = await self._request('GET', url, save, **kwargs)
+        return bool(result)
+
+    def fetch_raw(self, url, **kwargs):
+        return self.run(self.afetch_raw(url, **kwargs))
+
+    def fetch(self, url, **kwargs):
+        return self.run(self.afetch(url, **kwargs))
+
+    def fetch_image(self, url, save_path, **kwargs):
+        return self.run(self.afetch_image(url, save_path, **kwargs))
+
+    def print_failed_requests(self):
+        if self.failed_requests:
+            print("\nFailed Requests:")
+            for url, error in self.failed_requests:
+                print(f"URL: {url} - Error: {error}")
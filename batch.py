@@ -0,0 +1,132 @@
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import yaml
+from crawler import Crawler
+from retry_scheduler import RetryBudget
+from http_cache import HttpCache
+from article_processor import ArticleProcessor
+from article_manager import Utility
+from metrics import ProgressReporter
+from run import build_book, ensure_url_scheme
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    "engine": "async",
+    "concurrency": 200,
+    "max_books": 4,
+    "proxy_pool_url": None,
+    "pool_size": 128,
+    "http2": False,
+    "retry_budget": 0.2,
+    "cache_dir": "cache",
+    "work_dir": "tmp",
+    "output_dir": "book",
+    "pipelined": True,
+    "optimize_images": "n",
+    "dedupe_content": False,
+    "volume_chapters": None,
+    "volume_mb": None,
+    "metrics_path": "tmp/batch_metrics.json",
+}
+
+REQUIRED_KEYS = ("url", "link_selector", "article_selector")
+
+def load_profiles(path):
+    """Read a batch file and return (settings, books).
+
+    The file has an optional `settings` mapping (see DEFAULT_SETTINGS) and a `books` list.
+    Each book has the values run.py asks for: url, link_selector, next_page_selector,
+    article_selector, remove_selectors (a list or a ';' separated string) and optional
+    metadata (title, author, language, identifier, output_filename). pipelined,
+    optimize_images, dedupe_content, volume_chapters and volume_mb can be overridden per book.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        data = yaml.safe_load(f) or {}
+    settings = {**DEFAULT_SETTINGS, **(data.get("settings") or {})}
+    books = []
+    names = set()
+    for index, profile in enumerate(data.get("books") or []):
+        missing = [key for key in REQUIRED_KEYS if not profile.get(key)]
+        if missing:
+            raise ValueError(f"Book #{index + 1} in {path} is missing {', '.join(missing)}")
+        book = dict(profile)
+        book["url"] = ensure_url_scheme(book["url"])
+        remove_selectors = book.get("remove_selectors") or []
+        if isinstance(remove_selectors, str):
+            remove_selectors = remove_selectors.split(";")
+        book["remove_selectors"] = [selector.strip() for selector in remove_selectors]
+        book["name"] = book.get("output_filename") or Utility.extract_second_level_domain(book["url"])
+        if book["name"] in names:
+            raise ValueError(f"Book #{index + 1} in {path} has the same output name as another book: {book['name']}")
+        names.add(book["name"])
+        books.append(book)
+    return settings, books
+
+def make_crawler(settings, cache):
+    # 所有书共用一个重试预算
+    retry_budget = RetryBudget(ratio=settings["retry_budget"])
+    if settings["engine"] == "async":
+        from async_crawler import AsyncCrawler
+        return AsyncCrawler(settings["proxy_pool_url"], concurrency=settings["concurrency"], cache=cache, retry_budget=retry_budget)
+    return Crawler(settings["proxy_pool_url"], cache=cache, pool_size=settings["pool_size"], http2=settings["http2"], retry_budget=retry_budget)
+
+def build_profile(crawler, processor, book, settings):
+    """Build one book and return a summary dict; errors are reported instead of raised."""
+    started = time.perf_counter()
+    try:
+        toc, epub_path = build_book(
+            crawler, book["url"], book["link_selector"], book.get("next_page_selector"), book["article_selector"],
+            book["remove_selectors"], book_name=book.get("title") or book["name"], language=book.get("language", "zh"),
+            author=book.get("author"), identifier=book.get("identifier"), epub_name=book["name"],
+            pipelined=book.get("pipelined", settings["pipelined"]),
+            optimize_images=book.get("optimize_images", settings["optimize_images"]),
+            dedupe_content=book.get("dedupe_content", settings["dedupe_content"]),
+            volume_chapters=book.get("volume_chapters", settings["volume_chapters"]),
+            volume_mb=book.get("volume_mb", settings["volume_mb"]),
+            progress=False, metrics_path=None, processor=processor,
+            work_dir=os.path.join(settings["work_dir"], book["name"]), output_dir=settings["output_dir"])
+        return {"name": book["name"], "chapters": len(toc), "epub": epub_path, "seconds": time.perf_counter() - started}
+    except Exception as e:
+        logger.exception(f"Failed to build {book['name']} from {book['url']}")
+        return {"name": book["name"], "error": str(e), "seconds": time.perf_counter() - started}
+
+def run_batch(path):
+    """Build every book in the batch file with one shared crawler, cache and process pool."""
+    settings, books = load_profiles(path)
+    # 所有书共用一个 crawler：连接池、按 host 的限速、编码缓存和 HTTP 缓存都只建立一次
+    cache = HttpCache(settings["cache_dir"])
+    crawler = make_crawler(settings, cache)
+    processor = ArticleProcessor()
+    reporter = ProgressReporter(crawler.metrics).start()
+    try:
+        with ThreadPoolExecutor(max_workers=settings["max_books"]) as executor:
+            results = list(executor.map(lambda book: build_profile(crawler, processor, book, settings), books))
+    finally:
+        reporter.stop()
+        processor.shutdown()
+        if settings["metrics_path"]:
+            os.makedirs(os.path.dirname(settings["metrics_path"]) or '.', exist_ok=True)
+            crawler.metrics.export(settings["metrics_path"])
+        crawler.print_failed_requests()
+        if crawler.is_async:
+            crawler.close()
+        cache.close()
+
+    for result in results:
+        if "error" in result:
+            print(f"FAILED {result['name']}: {result['error']}")
+        else:
+            print(f"OK     {result['name']}: {result['chapters']} chapters in {result['seconds']:.1f}s -> {result['epub']}")
+    return results
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    if len(sys.argv) != 2:
+        print("Usage: python batch.py books.yaml")
+        sys.exit(2)
+    results = run_batch(sys.argv[1])
+    sys.exit(1 if any("error" in result for result in results) else 0)
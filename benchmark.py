@@ -0,0 +1,265 @@
+import argparse
+import json
+import logging
+import os
+import random
+import resource
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+SENTENCE = "这是一段用于基准测试的正文内容，The quick brown fox jumps over the lazy dog. "
+
+def make_png(seed, size=64):
+    """生成一张内容由 seed 决定的 RGB 噪点 PNG，每个章节的图片都不相同，不会被按内容去重。"""
+    rng = random.Random(seed)
+    rows = b''.join(b'\x00' + rng.randbytes(size * 3) for _ in range(size))
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+    header = struct.pack('>IIBBBBB', size, size, 8, 2, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', zlib.compress(rows)) + chunk(b'IEND', b'')
+
+class SyntheticSite:
+    """本地的小说站点替身，用于离线测量抓取吞吐量。
+
+    目录分 toc_pages 页，共 chapters 个章节，每章约 page_size 字节正文和 images_per_chapter 张图片。
+    每个请求先等待 latency 秒，再以 error_rate 的概率返回 503。
+    """
+
+    def __init__(self, chapters=500, toc_pages=10, images_per_chapter=1, page_size=16 * 1024,
+                 encoding='utf-8', latency=0.0, error_rate=0.0, seed=0):
+        self.chapters = chapters
+        self.toc_pages = max(1, min(toc_pages, chapters))
+        self.images_per_chapter = images_per_chapter
+        self.page_size = page_size
+        self.encoding = encoding
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests = 0
+        self.errors = 0
+        self.bytes_sent = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def toc_url(self, page=0):
+        return f"{self.url}/toc/{page}.html"
+
+    def _html(self, title, body):
+        return (f'<html><head><meta charset="{self.encoding}"><title>{title}</title></head>'
+                f'<body>{body}</body></html>').encode(self.encoding)
+
+    def toc_page(self, page):
+        per_page = -(-self.chapters // self.toc_pages)
+        first = page * per_page
+        links = ''.join(f'<li><a href="/chapter/{i}.html">第{i + 1}章</a></li>'
+                        for i in range(first, min(first + per_page, self.chapters)))
+        next_link = f'<a class="next" href="/toc/{page + 1}.html">下一页</a>' if page + 1 < self.toc_pages else ''
+        return self._html(f"目录 {page + 1}", f'<ul class="toc">{links}</ul>{next_link}')
+
+    def chapter_page(self, index):
+        paragraphs = []
+        size = 0
+        while size < self.page_size:
+            paragraph = f"<p>{SENTENCE * 4}</p>"
+            paragraphs.append(paragraph)
+            size += len(paragraph.encode(self.encoding))
+        images = ''.join(f'<img src="/image/{index}_{i}.png">' for i in range(self.images_per_chapter))
+        return self._html(f"第{index + 1}章",
+                          f'<div class="ad">广告</div><div id="content"><h1>第{index + 1}章</h1>{images}{"".join(paragraphs)}</div>')
+
+    def _route(self, path):
+        name, ext = os.path.splitext(path.rsplit('/', 1)[-1])
+        if path.startswith('/toc/') and int(name) < self.toc_pages:
+            return self.toc_page(int(name)), f'text/html; charset={self.encoding}'
+        if path.startswith('/chapter/') and int(name) < self.chapters:
+            return self.chapter_page(int(name)), f'text/html; charset={self.encoding}'
+        if path.startswith('/image/') and ext == '.png':
+            return make_png(name), 'image/png'
+        return None, None
+
+    def _handler(self):
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if site.latency:
+                    time.sleep(site.latency)
+                with site._lock:
+                    site.requests += 1
+                    failed = site._random.random() < site.error_rate
+                    if failed:
+                        site.errors += 1
+                try:
+                    body, content_type = (None, None) if failed else site._route(self.path)
+                except ValueError:
+                    body, content_type = None, None
+                status = 503 if failed else (200 if body is not None else 404)
+                body = body or b''
+                self.send_response(status)
+                self.send_header('Content-Type', content_type or 'text/plain')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                with site._lock:
+                    site.bytes_sent += len(body)
+
+        return Handler
+
+    def start(self, port=0):
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+def peak_rss_mb():
+    """Peak resident set size of this process and of its finished children, in MB."""
+    # Linux 上 ru_maxrss 的单位是 KB，macOS 上是字节
+    scale = 1024 * 1024 if os.uname().sysname == 'Darwin' else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    return own, children
+
+def run_benchmark(site, engine='threads', concurrency=200, pipelined=True, optimize_images="n", work_dir=None,
+                  progress=False, volume_chapters=None, pool_size=128, http2=False):
+    """Run the full run.py pipeline against a started SyntheticSite and return the measurements."""
+    from crawler import Crawler
+    from async_crawler import AsyncCrawler
+    from run import build_book
+
+    work_dir = work_dir or tempfile.mkdtemp(prefix='web2book-bench-')
+    cwd = os.getcwd()
+    # 各阶段都写入相对路径 tmp/ 和 book/，在独立目录中运行，互不干扰
+    os.chdir(work_dir)
+    if engine == "async":
+        crawler = AsyncCrawler(concurrency=concurrency)
+    else:
+        crawler = Crawler(pool_size=pool_size, http2=http2)
+    timings = {}
+    try:
+        started = time.perf_counter()
+        toc, epub_path = build_book(crawler, site.toc_url(), 'ul.toc a', 'a.next', '#content', ['.ad'],
+                                    book_name='benchmark', pipelined=pipelined, optimize_images=optimize_images,
+                                    timings=timings, progress=progress, volume_chapters=volume_chapters)
+        total = time.perf_counter() - started
+    finally:
+        if crawler.is_async:
+            crawler.close()
+        os.chdir(cwd)
+
+    rss, children_rss = peak_rss_mb()
+    epub_paths = epub_path if isinstance(epub_path, list) else [epub_path] if epub_path else []
+    return {
+        "engine": engine,
+        "pipelined": pipelined,
+        "chapters": len(toc),
+        "requests": site.requests,
+        "injected_errors": site.errors,
+        "failed_requests": len(crawler.failed_requests),
+        "seconds": total,
+        "chapters_per_second": len(toc) / total if total else 0.0,
+        "mb_per_second": site.bytes_sent / 1024 / 1024 / total if total else 0.0,
+        "megabytes": site.bytes_sent / 1024 / 1024,
+        "stages": timings,
+        "peak_rss_mb": rss,
+        "peak_children_rss_mb": children_rss,
+        "epub_path": epub_path,
+        "epub_mb": sum(os.path.getsize(os.path.join(work_dir, path)) for path in epub_paths) / 1024 / 1024,
+        "work_dir": work_dir,
+        "metrics": crawler.metrics.snapshot(),
+    }
+
+def print_report(result):
+    print(f"Engine: {result['engine']}{' (pipelined)' if result['pipelined'] else ''}")
+    print(f"Chapters: {result['chapters']} in {result['seconds']:.2f}s "
+          f"({result['chapters_per_second']:.1f} chapters/s, {result['mb_per_second']:.2f} MB/s, "
+          f"{result['megabytes']:.2f} MB downloaded)")
+    print(f"Requests: {result['requests']} ({result['injected_errors']} injected errors, "
+          f"{result['failed_requests']} failed after retries)")
+    for stage, seconds in result['stages'].items():
+        print(f"  {stage:<10} {seconds:8.2f}s")
+    # 各阶段累计耗时（多个线程/协程的耗时相加），用于判断瓶颈在哪个阶段
+    for stage, summary in result['metrics']['stages'].items():
+        print(f"  {stage:<10} busy {summary['seconds']:8.2f}s over {summary['count']} calls "
+              f"(p50 {summary['p50']}s, p95 {summary['p95']}s)")
+    counters = result['metrics']['counters']
+    from article_processor import markup_report
+    report = markup_report(counters)
+    if report:
+        print(report)
+    if counters.get('retries') or counters.get('retries_deferred'):
+        print(f"Retries: {counters.get('retries', 0)} in place, {counters.get('retries_deferred', 0)} deferred, "
+              f"{counters.get('retries_parked', 0)} in the final pass, {counters.get('retries_denied', 0)} over budget")
+    gauges = result['metrics']['gauges']
+    for prefix in ('http', 'http2'):
+        if gauges.get(f'{prefix}_requests_sent'):
+            print(f"Connections ({prefix}): {gauges[f'{prefix}_connections_opened']} opened for "
+                  f"{gauges[f'{prefix}_requests_sent']} requests ({100 * gauges[f'{prefix}_connection_reuse_ratio']:.1f}% reused)")
+    print(f"Peak RSS: {result['peak_rss_mb']:.1f} MB (worker processes {result['peak_children_rss_mb']:.1f} MB)")
+    print(f"EPUB: {result['epub_mb']:.2f} MB")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the crawl pipeline against a local synthetic novel site.")
+    parser.add_argument('--chapters', type=int, default=500)
+    parser.add_argument('--toc-pages', type=int, default=10)
+    parser.add_argument('--images', type=int, default=1, help="images per chapter")
+    parser.add_argument('--page-size', type=int, default=16 * 1024, help="approximate chapter size in bytes")
+    parser.add_argument('--encoding', default='utf-8', help="page encoding, e.g. utf-8 or gbk")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds to wait before each response")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of requests answered with 503")
+    parser.add_argument('--engine', choices=['threads', 'async'], default='threads')
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--no-pipeline', action='store_true', help="crawl the whole TOC before downloading chapters")
+    parser.add_argument('--optimize-images', choices=['n', 'y', 'gray'], default='n')
+    parser.add_argument('--pool-size', type=int, default=128, help="connections kept per host by the threads engine")
+    parser.add_argument('--http2', action='store_true', help="send requests over HTTP/2 with httpx (threads engine)")
+    parser.add_argument('--volume-chapters', type=int, help="split the EPUB into volumes of this many chapters")
+    parser.add_argument('--work-dir', help="directory for tmp/ and book/ (a new temporary directory by default)")
+    parser.add_argument('--keep', action='store_true', help="keep the work directory")
+    parser.add_argument('--json', help="also write the results to this file")
+    parser.add_argument('--progress', action='store_true', help="show the live progress line")
+    args = parser.parse_args()
+
+    # 先配置日志，模块导入时的 basicConfig 不会再把级别调回 INFO
+    logging.basicConfig(level=logging.WARNING)
+    site = SyntheticSite(chapters=args.chapters, toc_pages=args.toc_pages, images_per_chapter=args.images,
+                         page_size=args.page_size, encoding=args.encoding, latency=args.latency,
+                         error_rate=args.error_rate).start()
+    try:
+        result = run_benchmark(site, engine=args.engine, concurrency=args.concurrency, pipelined=not args.no_pipeline,
+                               optimize_images=args.optimize_images, work_dir=args.work_dir, progress=args.progress,
+                               volume_chapters=args.volume_chapters, pool_size=args.pool_size, http2=args.http2)
+    finally:
+        site.stop()
+    print_report(result)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+    if not args.keep and not args.work_dir:
+        shutil.rmtree(result['work_dir'], ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import hashlib
+import logging
+import os
+import re
+import shutil
+import threading
+
+logger = logging.getLogger(__name__)
+
+# 按顺序查找能显示中文的字体，找不到时退回 Pillow 自带的位图字体
+FONT_CANDIDATES = (
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/google-noto-cjk/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/truetype/wqy/wqy-microhei.ttc",
+    "/usr/share/fonts/truetype/wqy/wqy-zenhei.ttc",
+    "/System/Library/Fonts/PingFang.ttc",
+    "/System/Library/Fonts/STHeiti Medium.ttc",
+    "C:/Windows/Fonts/msyh.ttc",
+    "C:/Windows/Fonts/simhei.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+)
+
+_font_path = None
+_font_lock = threading.Lock()
+
+def find_font(font_path=None):
+    """Return the first usable font file: font_path, $WEB2BOOK_COVER_FONT, then FONT_CANDIDATES."""
+    global _font_path
+    if font_path:
+        return font_path
+    with _font_lock:
+        if _font_path is None:
+            candidates = (os.environ.get("WEB2BOOK_COVER_FONT"),) + FONT_CANDIDATES
+            _font_path = next((path for path in candidates if path and os.path.exists(path)), '')
+            if not _font_path:
+                logger.warning("No TrueType font found for the cover, set WEB2BOOK_COVER_FONT to a CJK font file")
+        return _font_path
+
+# 中文逐字断行，英文等以空格分词的文字按单词断行
+TOKEN_PATTERN = re.compile(r'[\u2e80-\u9fff\uf900-\ufaff\uff00-\uffef]|[^\s\u2e80-\u9fff\uf900-\ufaff\uff00-\uffef]+\s*|\s+')
+
+def _wrap(draw, text, font, max_width):
+    lines = []
+    line = ''
+    for token in TOKEN_PATTERN.findall(text):
+        # 单个单词比一行还宽时只能逐字拆开
+        pieces = [token] if draw.textlength(token.rstrip(), font=font) <= max_width else list(token)
+        for piece in pieces:
+            if line and draw.textlength((line + piece).rstrip(), font=font) > max_width:
+                lines.append(line.rstrip())
+                line = piece.lstrip()
+            else:
+                line += piece
+    if line.strip():
+        lines.append(line.rstrip())
+    return lines
+
+def _layout(draw, title, size, font_path):
+    from PIL import ImageFont
+    width, height = size
+    font_size = width // 8
+    while True:
+        font = ImageFont.truetype(font_path, font_size)
+        lines = _wrap(draw, title, font, width * 0.85)
+        line_height = font_size * 1.3
+        if len(lines) * line_height <= height * 0.8 or font_size <= 24:
+            return font, lines, line_height
+        font_size = int(font_size * 0.85)
+
+def draw_cover(title, size=(1600, 2560), bg_color="white", fg_color="black", font_path=None):
+    """Draw the title centred on a plain background and return the PIL image."""
+    from PIL import Image, ImageDraw, ImageFont
+    image = Image.new("RGB", size, bg_color)
+    draw = ImageDraw.Draw(image)
+    font_path = find_font(font_path)
+    if not font_path:
+        # 位图字体只有一种字号，先画小图再放大
+        font = ImageFont.load_default()
+        small = Image.new("RGB", (size[0] // 8, size[1] // 8), bg_color)
+        small_draw = ImageDraw.Draw(small)
+        left, top, right, bottom = small_draw.textbbox((0, 0), title, font=font)
+        small_draw.text(((small.width - right - left) / 2, (small.height - bottom - top) / 2), title, fill=fg_color, font=font)
+        return small.resize(size, Image.NEAREST)
+    font, lines, line_height = _layout(draw, title, size, font_path)
+    top = (size[1] - line_height * len(lines)) / 2 + line_height / 2
+    for i, line in enumerate(lines):
+        draw.text((size[0] / 2, top + i * line_height), line, fill=fg_color, font=font, anchor="mm")
+    return image
+
+def render_cover(title, save_path, size=(1600, 2560), bg_color="white", fg_color="black", font_path=None,
+                 cache_dir=os.path.join('cache', 'covers')):
+    """Render a title cover to save_path as JPEG, reusing a cached copy for the same title, size and colours."""
+    key = hashlib.sha1(f"{title}\0{size}\0{bg_color}\0{fg_color}\0{font_path}".encode()).hexdigest()
+    cached_path = os.path.join(cache_dir, key + '.jpg') if cache_dir else None
+    directory = os.path.dirname(save_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if cached_path and os.path.exists(cached_path):
+        shutil.copyfile(cached_path, save_path)
+        return save_path
+
+    image = draw_cover(title, size, bg_color, fg_color, font_path)
+    image.save(save_path, "JPEG", quality=90)
+    if cached_path:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{cached_path}.{threading.get_ident()}.tmp"
+        shutil.copyfile(save_path, tmp_path)
+        os.replace(tmp_path, cached_path)
+    return save_path
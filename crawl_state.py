@@ -0,0 +1,167 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+
+class CrawlState:
+    """记录抓取进度的 sqlite 数据库，用于中断后继续抓取。
+
+    tocs 记录每个目录的翻页进度，chapters 记录每个目录条目的抓取状态、尝试次数和输出文件，
+    images 记录每张图片的下载结果，fingerprints 记录开启内容去重时已保存和被判为重复的章节的正文指纹。
+    """
+
+    def __init__(self, db_path='tmp/crawl_state.db'):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS tocs (
+                target_url TEXT PRIMARY KEY,
+                page_url TEXT,
+                next_url TEXT,
+                encoding TEXT,
+                complete INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS chapters (
+                url TEXT PRIMARY KEY,
+                target_url TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                chapter_title TEXT,
+                filename TEXT,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                output_file TEXT,
+                updated REAL
+            );
+            CREATE INDEX IF NOT EXISTS chapters_target ON chapters (target_url, position);
+            CREATE TABLE IF NOT EXISTS images (
+                url TEXT PRIMARY KEY,
+                path TEXT,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                updated REAL
+            );
+            CREATE TABLE IF NOT EXISTS fingerprints (
+                url TEXT PRIMARY KEY,
+                fingerprint BLOB NOT NULL,
+                duplicate INTEGER NOT NULL DEFAULT 0
+            );
+        """)
+        # 较早版本创建的数据库没有 page_url 列；为空时从目录首页重新开始
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(tocs)")]
+        if 'page_url' not in columns:
+            self._db.execute("ALTER TABLE tocs ADD COLUMN page_url TEXT")
+        self._db.commit()
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            cursor = self._db.execute(sql, params)
+            self._db.commit()
+            return cursor
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    # TOC
+
+    def load_toc(self, target_url):
+        """Return (toc, page_url, next_url, encoding, complete) recorded for target_url, or None if it was never crawled.
+
+        page_url is the last TOC page that was fetched.
+        """
+        rows = self._query("SELECT page_url, next_url, encoding, complete FROM tocs WHERE target_url = ?", (target_url,))
+        if not rows:
+            return None
+        page_url, next_url, encoding, complete = rows[0]
+        chapters = self._query(
+            "SELECT chapter_title, url, filename FROM chapters WHERE target_url = ? ORDER BY position", (target_url,))
+        toc = [{"chapter_title": title, "url": url, "filename": filename} for title, url, filename in chapters]
+        return toc, page_url, next_url, encoding, bool(complete)
+
+    def add_toc_page(self, target_url, page_url, entries, next_url, encoding):
+        """Record the entries parsed from the TOC page page_url and where to continue from."""
+        with self._lock:
+            position = self._db.execute(
+                "SELECT COALESCE(MAX(position) + 1, 0) FROM chapters WHERE target_url = ?", (target_url,)).fetchone()[0]
+            for offset, entry in enumerate(entries):
+                # INSERT OR IGNORE 保留已有条目的抓取状态
+                self._db.execute(
+                    "INSERT OR IGNORE INTO chapters (url, target_url, position, chapter_title, filename) VALUES (?, ?, ?, ?, ?)",
+                    (entry["url"], target_url, position + offset, entry["chapter_title"], entry["filename"]))
+            self._db.execute(
+                "INSERT OR REPLACE INTO tocs (target_url, page_url, next_url, encoding, complete) VALUES (?, ?, ?, ?, ?)",
+                (target_url, page_url, next_url, encoding, 0 if next_url else 1))
+            self._db.commit()
+
+    # Chapters
+
+    def done_urls(self, base_dir='tmp', store=None):
+        """Return the URLs of chapters that were downloaded and are still on disk (or in store, a PackStore).
+
+        Chapters skipped as duplicates have no output and always count as done.
+        """
+        rows = self._query(
+            """SELECT chapters.url, output_file, duplicate FROM chapters LEFT JOIN fingerprints ON fingerprints.url = chapters.url
+               WHERE status = ?""", (DONE,))
+        if store is not None:
+            return {url for url, output_file, duplicate in rows if duplicate or (output_file and output_file in store)}
+        return {url for url, output_file, duplicate in rows
+                if duplicate or (output_file and os.path.exists(os.path.join(base_dir, output_file)))}
+
+    def mark_started(self, url):
+        self._execute("UPDATE chapters SET attempts = attempts + 1, updated = ? WHERE url = ?", (time.time(), url))
+
+    def mark_done(self, url, output_file):
+        self._execute("UPDATE chapters SET status = ?, output_file = ?, error = NULL, updated = ? WHERE url = ?",
+                      (DONE, output_file, time.time(), url))
+
+    def mark_failed(self, url, error):
+        self._execute("UPDATE chapters SET status = ?, error = ?, updated = ? WHERE url = ?",
+                      (FAILED, str(error), time.time(), url))
+
+    def record_fingerprint(self, url, fingerprint, duplicate=False):
+        self._execute("INSERT OR REPLACE INTO fingerprints (url, fingerprint, duplicate) VALUES (?, ?, ?)",
+                      (url, fingerprint, int(duplicate)))
+
+    def fingerprints(self):
+        """Return (url, fingerprint, duplicate) for every chapter recorded with record_fingerprint."""
+        return [(url, bytes(fingerprint), bool(duplicate))
+                for url, fingerprint, duplicate in self._query("SELECT url, fingerprint, duplicate FROM fingerprints")]
+
+    def summary(self):
+        """Return {status: chapter count} for the chapters recorded so far."""
+        return dict(self._query("SELECT status, COUNT(*) FROM chapters GROUP BY status"))
+
+    # Images
+
+    def image_path(self, url):
+        """Return the saved path of an image downloaded in an earlier run, if it is still on disk."""
+        rows = self._query("SELECT path FROM images WHERE url = ? AND status = ?", (url, DONE))
+        if rows and rows[0][0] and os.path.exists(rows[0][0]):
+            return rows[0][0]
+        return None
+
+    def mark_image(self, url, path, error=None):
+        status = FAILED if error else DONE
+        self._execute(
+            """INSERT INTO images (url, path, status, attempts, error, updated) VALUES (?, ?, ?, 1, ?, ?)
+               ON CONFLICT(url) DO UPDATE SET path = excluded.path, status = excluded.status,
+               attempts = attempts + 1, error = excluded.error, updated = excluded.updated""",
+            (url, path, status, error, time.time()))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -1,61 +1,161 @@
 import requests
-from fake_useragent import UserAgent
 import logging
+import threading
 import time
-import inquirer
+from rate_limiter import RateLimiter, classify_status, THROTTLED, ERROR
+from proxy_manager import ProxyManager
+from encoding import EncodingResolver
+from metrics import Metrics
+from timeout_policy import TimeoutPolicy, remaining
+from http_transport import PooledHTTPAdapter, Http2Session, reuse_stats
+from retry_scheduler import RetryBudget
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+_user_agents = None
+_user_agents_lock = threading.Lock()
+
+def random_user_agent():
+    """Return a random User-Agent string.
+
+    fake_useragent loads its browser database on construction, so a single instance is created
+    on first use and shared by every crawler in the process.
+    """
+    global _user_agents
+    if _user_agents is None:
+        with _user_agents_lock:
+            if _user_agents is None:
+                from fake_useragent import UserAgent
+                _user_agents = UserAgent()
+    return _user_agents.random
+
 class Crawler:
-    def __init__(self, proxy_pool_url=None, max_retries=3):
-        self.ua = UserAgent()
+    is_async = False
+
+    # 代理被封或失效时常见的状态码
+    PROXY_FAILURE_STATUS_CODES = {403, 407, 429}
+
+    def __init__(self, proxy_pool_url=None, max_retries=3, rate_limiter=None, cache=None, proxy_manager=None, metrics=None, timeout_policy=None,
+                 pool_size=128, http2=False, retry_budget=None):
         self.proxy_pool_url = proxy_pool_url
+        if proxy_manager is None and proxy_pool_url:
+            proxy_manager = ProxyManager(proxy_pool_url)
+        self.proxy_manager = proxy_manager
         self.max_retries = max_retries
+        self.rate_limiter = rate_limiter if rate_limiter else RateLimiter()
+        self.cache = cache
+        self.encoding_resolver = EncodingResolver()
+        self.metrics = metrics if metrics else Metrics()
+        self.timeout_policy = timeout_policy if timeout_policy else TimeoutPolicy()
         self.failed_requests = []
+        self._failed_lock = threading.Lock()
+        # 所有请求共用的重试预算，失败的请求不会把请求量成倍放大
+        self.retry_budget = retry_budget if retry_budget else RetryBudget()
         self.session = requests.Session()
+        # 每个 host 的连接池要容纳文章线程和图片线程（默认各 64 个），否则连接会被反复关闭、重新握手
+        self.adapter = PooledHTTPAdapter(pool_maxsize=pool_size)
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+        # HTTP/2 时同一 host 的请求在少数几个连接上多路复用
+        self.http2 = Http2Session(pool_size) if http2 else None
+        self.metrics.add_collector(self.connection_stats)
+        self.metrics.add_collector(self.encoding_resolver.stats)
+        self.metrics.add_collector(self.rate_limiter.stats)
+        self.metrics.add_collector(self.timeout_policy.stats)
+        if self.proxy_manager:
+            self.metrics.add_collector(self.proxy_manager.stats)
 
     def _get_proxy(self):
-        if self.proxy_pool_url:
-            return requests.get(self.proxy_pool_url).text.strip()
+        if self.proxy_manager:
+            return self.proxy_manager.get()
         return None
 
     def _wait_time(self, attempt, backoff_factor=2):
         return backoff_factor ** attempt
     
-    def _make_request(self, method, url, timeout=(5, 10), **kwargs):
+    def _make_request(self, method, url, timeout=None, deadline=None, retries=None, **kwargs):
         headers = kwargs.pop('headers', {})
-        headers['User-Agent'] = self.ua.random
-        proxies = {}
+        headers['User-Agent'] = random_user_agent()
+        # retries=0 时失败立即返回，由调用方通过 RetryScheduler 或共享队列延迟重试，不在本线程中 sleep。
+        # 其余请求（目录页：下一页的地址要等这一页抓到才知道，线程没有别的事可做）仍在本线程中退避重试
+        max_retries = self.max_retries if retries is None else retries
 
-        if self.proxy_pool_url:
+        for attempt in range(max_retries + 1):
+            # 超时由 timeout_policy 按 host 的历史耗时确定，并且不超过 deadline 剩余的时间
+            request_timeout = timeout if timeout else self.timeout_policy.timeout(url, deadline)
+            if min(request_timeout) <= 0:
+                return self._request_failed(url, "deadline exceeded")
+            # 每次尝试重新挑选代理，失败的代理不会被连续使用
             proxy_address = self._get_proxy()
-            proxies = {'http': 'http://' + proxy_address}
-        
-        for attempt in range(self.max_retries + 1):
+            proxies = ProxyManager.as_requests_proxies(proxy_address)
+            # 每个 host 的并发由 rate_limiter 自适应控制，重试等待期间不占用名额
+            token = self.rate_limiter.acquire(url)
+            self.retry_budget.record_request()
+            started = time.monotonic()
+            # 无论请求以何种方式结束都要归还名额，否则该 host 的并发会被永久占用
+            outcome = ERROR
+            response = None
             try:
-                response = self.session.request(method, url, headers=headers, proxies=proxies, timeout=timeout, **kwargs)
+                session = self.http2 if self.http2 and not proxies else self.session
+                response = session.request(method, url, headers=headers, proxies=proxies, timeout=request_timeout, **kwargs)
+                outcome = classify_status(response.status_code)
+                elapsed = time.monotonic() - started
+                self.timeout_policy.observe(url, elapsed)
+                self.metrics.observe_request(url, response.status_code, elapsed)
+                if self.proxy_manager:
+                    self.proxy_manager.report(proxy_address, response.status_code not in self.PROXY_FAILURE_STATUS_CODES, elapsed)
                 response.raise_for_status()
+                if self.failed_requests:
+                    self._recovered(url)
                 return response
-            
-            except requests.Timeout as e:
-                new_timeout = self.handle_timeout(url, timeout)
-                if new_timeout:
-                    timeout = new_timeout
-                else:
-                    self.failed_requests.append((url, str(e)))
-                    logger.error(f"Request failed for URL: {url} with error: {e}")
-                    return None  # 直接返回None，表示请求失败
 
             except requests.RequestException as e:
-                if attempt == self.max_retries:
-                    self.failed_requests.append((url, str(e)))
-                    logger.error(f"Request failed for URL: {url} with error: {e}")
-                    return None  # 直接返回None，表示请求失败
-                else:
-                    wait_time = self._wait_time(attempt)
-                    logger.info(f"Retrying in {wait_time}s...")
-                    time.sleep(wait_time)
+                if response is None:
+                    timed_out = isinstance(e, requests.Timeout)
+                    outcome = THROTTLED if timed_out else ERROR
+                    self.metrics.observe_request(url, 'timeout' if timed_out else 'error', time.monotonic() - started)
+                    if timed_out:
+                        # 不再询问用户，放宽该 host 的超时后自动重试
+                        self.timeout_policy.timed_out(url)
+                    if self.proxy_manager and isinstance(e, (requests.Timeout, requests.ConnectionError, requests.exceptions.ProxyError)):
+                        self.proxy_manager.report(proxy_address, False)
+                error = e
+            finally:
+                self.rate_limiter.release(token, outcome)
+
+            if attempt == max_retries:
+                return self._request_failed(url, error, deferred=retries == 0)
+            wait_time = self._wait_time(attempt)
+            left = remaining(deadline)
+            if left is not None and wait_time >= left:
+                return self._request_failed(url, f"deadline exceeded after {attempt + 1} attempts: {error}")
+            if not self.retry_budget.spend():
+                self.metrics.incr('retries_denied')
+                return self._request_failed(url, f"retry budget exhausted: {error}")
+            self.metrics.incr('retries')
+            logger.info(f"Retrying in {wait_time}s...")
+            time.sleep(wait_time)
+
+    def connection_stats(self):
+        """Keep-alive reuse gauges: requests sent, connections opened and the share of requests that reused a connection."""
+        stats = reuse_stats(self.adapter.stats())
+        if self.http2:
+            stats.update(reuse_stats(self.http2.stats(), prefix='http2'))
+        return stats
+
+    def _request_failed(self, url, error, deferred=False):
+        with self._failed_lock:
+            self.failed_requests.append((url, str(error)))
+        self.metrics.incr('failed_requests')
+        # deferred：调用方稍后还会重试，最终失败时由调用方记录错误
+        log = logger.warning if deferred else logger.error
+        log(f"Request failed for URL: {url} with error: {error}")
+        return None  # 直接返回None，表示请求失败
+
+    def _recovered(self, url):
+        # 延迟重试后成功的 URL 不再算作失败
+        with self._failed_lock:
+            self.failed_requests[:] = [(failed_url, error) for failed_url, error in self.failed_requests if failed_url != url]
 
     # def _make_request(self, method, url, timeout=(5, 15), **kwargs):
     #     headers = kwargs.pop('headers', {})
@@ -89,36 +189,59 @@ class Crawler:
     #                 logger.info(f"Retrying in {wait_time}s...")
     #                 time.sleep(wait_time)
 
-    def handle_timeout(self, url, timeout):            
-        questions = [
-            inquirer.Text('new_timeout', message=f"Request for {url} timed out after {timeout[1]} seconds. Enter new timeout in seconds (or press Enter to skip):")
-        ]
-        answers = inquirer.prompt(questions)
+    def _cached_request(self, url, **kwargs):
+        """GET with the response cache. Returns (response, entry); a None response means the entry can be used as-is."""
+        entry = self.cache.get(url) if self.cache else None
+        if entry:
+            if self.cache.is_fresh(entry):
+                self.cache.hit(entry)
+                return None, entry
+            kwargs['headers'] = {**kwargs.get('headers', {}), **self.cache.conditional_headers(entry)}
+        response = self._make_request('GET', url, **kwargs)
+        if response is not None and response.status_code == 304 and entry:
+            self.cache.refresh(entry, response.headers)
+            self.cache.hit(entry, revalidated=True)
+            return None, entry
+        return response, None
+
+    def fetch_raw(self, url, **kwargs):
+        """Fetch url and return the undecoded body with its resolved encoding, or None on failure."""
         try:
-            return (5, int(answers['new_timeout']))
-        except (TypeError, ValueError):
+            response, entry = self._cached_request(url, **kwargs)
+            if entry:
+                body = self.cache.read(entry)
+                content_type = entry["content_type"]
+            elif response is not None:
+                body = response.content
+                content_type = response.headers.get('Content-Type')
+                self.metrics.add_bytes(url, len(body))
+                if self.cache:
+                    self.cache.store(url, body, response.headers)
+            else:
+                return None
+            return {"content": body, "encoding": self.encoding_resolver.resolve(body, content_type, url)}
+        except Exception as e:
+            logger.error(f"Failed to fetch {url}. Error: {e}")
             return None
-            
+
     def fetch(self, url, **kwargs):
-        try:
-            response = self._make_request('GET', url, **kwargs)
-            encoding = response.encoding
-            try:
-                response.text.encode(response.apparent_encoding)
-                encoding = response.apparent_encoding
-            except:
-                encoding = 'utf-8'
-            response.encoding = encoding
-            return {"content": response.text, "encoding": encoding} if response else None
-        except Exception as e:
+        raw = self.fetch_raw(url, **kwargs)
+        if raw is None:
             return None
+        return {"content": raw["content"].decode(raw["encoding"], errors='replace'), "encoding": raw["encoding"]}
 
     def fetch_image(self, url, save_path, **kwargs):
-        response = self._make_request('GET', url, stream=True, **kwargs)
+        response, entry = self._cached_request(url, stream=True, **kwargs)
+        if entry:
+            self.cache.copy_to(entry, save_path)
+            return True
         if response:
             with open(save_path, 'wb') as file:
                 for chunk in response.iter_content(chunk_size=8192):
                     file.write(chunk)
+                    self.metrics.add_bytes(url, len(chunk))
+            if self.cache:
+                self.cache.store_file(url, save_path, response.headers)
             return True
         return False
 
@@ -0,0 +1,302 @@
+import argparse
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+from article_manager import ArticleDownloader, ImageHandler, TOCManager, Utility
+from article_processor import ArticleProcessor
+from cover import render_cover
+from http_cache import HttpCache
+from image_manifest import ImageManifest
+from metrics import ProgressReporter
+from pack_store import PackStore
+from retry_scheduler import RetryScheduler
+from run import assemble_epub
+from url_index import SeenIndex, content_fingerprint
+from work_queue import MemoryWorkQueue, RedisWorkQueue
+
+logger = logging.getLogger(__name__)
+
+class Worker:
+    """从共享队列领取章节、下载并清理后把结果和图片上报回队列。
+
+    可以在任意多台机器上各运行一个，每个 worker 用 threads 个线程同时处理章节。
+    一篇文章的处理时间受 article_timeout 限制，队列的租约应比它更长，否则正常的章节也会被重新分配。
+    """
+
+    def __init__(self, queue, crawler, worker_id=None, threads=16, work_dir=os.path.join('tmp', 'worker'),
+                 processor=None, article_timeout=120, poll_interval=1.0):
+        self.queue = queue
+        self.crawler = crawler
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.threads = threads
+        self.work_dir = work_dir
+        self.processor = processor
+        self.article_timeout = article_timeout
+        self.poll_interval = poll_interval
+        self.metrics = crawler.metrics
+
+    def _wait_config(self):
+        while True:
+            config = self.queue.get_config()
+            if config is not None:
+                return config
+            time.sleep(self.poll_interval)
+
+    def run(self):
+        """Process chapters until the coordinator has published the whole TOC and nothing is left."""
+        config = self._wait_config()
+        utility = Utility()
+        os.makedirs(self.work_dir, exist_ok=True)
+        # 图片失败时进入延迟队列；章节失败时交回共享队列排到末尾，由任意 worker 稍后重试
+        retry_scheduler = RetryScheduler(self.crawler.retry_budget, metrics=self.metrics)
+        image_handler = ImageHandler(self.crawler, utility, base_dir=self.work_dir, retry_scheduler=retry_scheduler)
+        own_processor = self.processor is None
+        processor = ArticleProcessor() if own_processor else self.processor
+        downloader = ArticleDownloader(self.crawler, utility, image_handler, processor=processor,
+                                       article_timeout=self.article_timeout, retry_scheduler=retry_scheduler)
+        threads = [threading.Thread(target=self._loop, args=(downloader, config, f"{self.worker_id}-{i}"))
+                   for i in range(self.threads)]
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            if own_processor:
+                processor.shutdown()
+            image_handler.scheduler.shutdown()
+            retry_scheduler.close()
+
+    def _loop(self, downloader, config, worker_id):
+        while True:
+            entry = self.queue.claim(worker_id)
+            if entry is None:
+                if self.queue.finished():
+                    return
+                time.sleep(self.poll_interval)
+                continue
+            self._process(downloader, entry, config)
+
+    def _process(self, downloader, entry, config):
+        url = entry['url']
+        deadline = time.monotonic() + self.article_timeout
+        error = "download failed"
+        try:
+            html = downloader.fetch_article(url, config['article_selector'], config['remove_selectors'], deadline)
+        except TimeoutError:
+            html = None
+            error = "timeout"
+            self.metrics.incr('article_timeouts')
+        except Exception as e:
+            logger.error(f"Error while downloading article from {url}. Error: {e}")
+            html = None
+            error = e
+        if not html:
+            self.metrics.incr('chapters_failed')
+            logger.warning(f"Returning {url} to the queue for a later retry. Error: {error}")
+            self.queue.fail(url, error)
+            return
+        images = {}
+        for name in html.get("images", []):
+            path = os.path.join(self.work_dir, name)
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    images[name] = f.read()
+        self.queue.complete(url, {"content": html["content"], "images": sorted(images)}, images)
+        self.metrics.incr('chapters_done')
+
+class Coordinator:
+    """抓取目录并把章节发布到共享队列，等 worker 全部完成后在本地汇总章节和图片并生成 EPUB。"""
+
+    def __init__(self, queue, crawler, work_dir='tmp', output_dir='book', poll_interval=1.0, dedupe_content=False):
+        self.queue = queue
+        self.crawler = crawler
+        self.work_dir = work_dir
+        self.output_dir = output_dir
+        self.poll_interval = poll_interval
+        self.dedupe_content = dedupe_content
+        self.metrics = crawler.metrics
+
+    def publish(self, target_url, link_selector, next_page_selector, article_selector, remove_selectors):
+        """Publish the job config and every TOC page as soon as it is parsed; return the full TOC."""
+        self.queue.set_config({"article_selector": article_selector, "remove_selectors": list(remove_selectors or [])})
+        toc_manager = TOCManager(self.crawler, Utility(), base_dir=self.work_dir)
+        toc = []
+        for entries, _ in toc_manager.iter_toc(target_url, link_selector, next_page_selector):
+            self.queue.publish(entries)
+            toc.extend(entries)
+            self.metrics.incr('chapters_queued', len(entries))
+        self.queue.close_toc()
+        return toc
+
+    def wait(self, progress=True):
+        """Block until every published chapter is done or has failed for good, and return the queue status."""
+        while True:
+            status = self.queue.status()
+            if progress:
+                sys.stderr.write(f"\rchapters {status['done']} done, {status['failed']} failed, "
+                                 f"{status['leased']} in progress, {status['pending']} pending")
+                sys.stderr.flush()
+            if self.queue.finished():
+                break
+            time.sleep(self.poll_interval)
+        if progress:
+            sys.stderr.write('\n')
+        return self.queue.status()
+
+    def collect(self, toc, store):
+        """Write the finished chapters to store and their images to work_dir; return the chapters and an ImageManifest."""
+        os.makedirs(self.work_dir, exist_ok=True)
+        image_manifest = ImageManifest(os.path.join(self.work_dir, 'images.yaml'))
+        chapters = []
+        fingerprints = SeenIndex() if self.dedupe_content else None
+        with self.metrics.timer('save'):
+            for entry in toc:
+                result = self.queue.result(entry['url'])
+                if result is None:
+                    continue
+                fingerprint = content_fingerprint(result["content"]) if fingerprints is not None else None
+                if fingerprint is not None and not fingerprints.add(fingerprint):
+                    self.metrics.incr('chapters_duplicate')
+                    continue
+                store.put(entry['filename'], result["content"])
+                for name in result["images"]:
+                    path = os.path.join(self.work_dir, name)
+                    if os.path.exists(path):
+                        continue
+                    data = self.queue.image(name)
+                    if data is not None:
+                        with open(path, 'wb') as f:
+                            f.write(data)
+                image_manifest.record(entry['filename'], result["images"])
+                chapters.append(entry)
+        image_manifest.save()
+        return chapters, image_manifest
+
+    def build(self, target_url, link_selector, next_page_selector, article_selector, remove_selectors,
+              book_name, language='zh', author=None, identifier=None, epub_name=None, progress=True,
+              volume_chapters=None, volume_mb=None):
+        """Run the whole job and return (chapters, epub_path); chapters are the TOC entries that made it into the book."""
+        toc = self.publish(target_url, link_selector, next_page_selector, article_selector, remove_selectors)
+        self.wait(progress)
+        with PackStore(os.path.join(self.work_dir, 'chapters.pack')) as store:
+            chapters, image_manifest = self.collect(toc, store)
+            for url, error in self.queue.failures().items():
+                logger.error(f"Chapter {url} failed: {error}")
+            with self.metrics.timer('epub'):
+                cover_path = os.path.join(self.work_dir, "cover.jpg")
+                try:
+                    render_cover(book_name, cover_path)
+                except Exception as e:
+                    logger.error(f"Failed to generate book cover. Error: {e}")
+                epub_path = assemble_epub(chapters, image_manifest, cover_path, book_name, language, author, identifier,
+                                          epub_name, self.work_dir, self.output_dir, volume_chapters, volume_mb, store)
+        return chapters, epub_path
+
+def make_queue(args, job):
+    if args.redis:
+        return RedisWorkQueue(args.redis, job=job, lease_seconds=args.lease, max_attempts=args.max_attempts)
+    return MemoryWorkQueue(job=job, lease_seconds=args.lease, max_attempts=args.max_attempts)
+
+def run_coordinator(args):
+    from batch import load_profiles, make_crawler
+    settings, books = load_profiles(args.profile)
+    if args.book:
+        books = [book for book in books if book["name"] == args.book]
+    if len(books) != 1:
+        raise SystemExit(f"{args.profile} must contain exactly one book, or pick one with --book")
+    book = books[0]
+    job = args.job or book["name"]
+    queue = make_queue(args, job)
+    if args.reset:
+        queue.reset()
+    cache = HttpCache(settings["cache_dir"])
+    crawler = make_crawler(settings, cache)
+    work_dir = os.path.join(settings["work_dir"], book["name"])
+    # 没有 Redis 时在本进程内启动 worker 线程，单机也能用同样的流程运行
+    local_workers = args.local_workers if args.redis else max(1, args.local_workers)
+    workers = [threading.Thread(target=Worker(queue, crawler, f"local-{i}", args.threads,
+                                              os.path.join(work_dir, 'worker', str(i))).run, daemon=True)
+               for i in range(local_workers)]
+    for worker in workers:
+        worker.start()
+    try:
+        coordinator = Coordinator(queue, crawler, work_dir, settings["output_dir"],
+                                  dedupe_content=book.get("dedupe_content", settings["dedupe_content"]))
+        chapters, epub_path = coordinator.build(
+            book["url"], book["link_selector"], book.get("next_page_selector"), book["article_selector"],
+            book["remove_selectors"], book_name=book.get("title") or book["name"], language=book.get("language", "zh"),
+            author=book.get("author"), identifier=book.get("identifier"), epub_name=book["name"],
+            volume_chapters=book.get("volume_chapters", settings["volume_chapters"]),
+            volume_mb=book.get("volume_mb", settings["volume_mb"]))
+        for worker in workers:
+            worker.join()
+        if settings["metrics_path"]:
+            crawler.metrics.export(os.path.join(work_dir, os.path.basename(settings["metrics_path"])))
+    finally:
+        crawler.print_failed_requests()
+        if crawler.is_async:
+            crawler.close()
+        cache.close()
+    print(f"{len(chapters)} chapters -> {epub_path}")
+    return epub_path
+
+def run_worker(args):
+    from batch import DEFAULT_SETTINGS, make_crawler
+    settings = {**DEFAULT_SETTINGS, "engine": args.engine, "concurrency": args.concurrency,
+                "proxy_pool_url": args.proxy_pool_url, "cache_dir": args.cache_dir}
+    queue = make_queue(args, args.job)
+    cache = HttpCache(settings["cache_dir"])
+    crawler = make_crawler(settings, cache)
+    reporter = ProgressReporter(crawler.metrics).start()
+    try:
+        Worker(queue, crawler, threads=args.threads, work_dir=args.work_dir, article_timeout=args.article_timeout).run()
+    finally:
+        reporter.stop()
+        crawler.print_failed_requests()
+        if crawler.is_async:
+            crawler.close()
+        cache.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Crawl one book with a coordinator and any number of workers sharing a Redis queue.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    def queue_arguments(subparser):
+        subparser.add_argument('--redis', help="Redis URL, e.g. redis://localhost:6379/0 (in-process queue when omitted)")
+        subparser.add_argument('--lease', type=float, default=180, help="seconds a worker may hold a chapter before it is requeued")
+        subparser.add_argument('--max-attempts', type=int, default=3, help="claims per chapter before it is marked failed")
+        subparser.add_argument('--threads', type=int, default=16, help="chapters processed at once per worker")
+
+    coordinator = subparsers.add_parser('coordinator', help="crawl the TOC, publish chapters and build the EPUB")
+    coordinator.add_argument('profile', help="YAML file in the batch.py format")
+    coordinator.add_argument('--book', help="name of the book to build when the file has several")
+    coordinator.add_argument('--job', help="queue name shared with the workers (the book name by default)")
+    coordinator.add_argument('--local-workers', type=int, default=0, help="also run this many workers in this process")
+    coordinator.add_argument('--reset', action='store_true', help="discard results of an earlier run of the same job")
+    queue_arguments(coordinator)
+
+    worker = subparsers.add_parser('worker', help="claim chapters from the queue until the job is finished")
+    worker.add_argument('--job', required=True)
+    worker.add_argument('--engine', choices=['threads', 'async'], default='async')
+    worker.add_argument('--concurrency', type=int, default=200)
+    worker.add_argument('--proxy-pool-url')
+    worker.add_argument('--cache-dir', default='cache')
+    worker.add_argument('--work-dir', default=os.path.join('tmp', 'worker'))
+    worker.add_argument('--article-timeout', type=float, default=120)
+    queue_arguments(worker)
+
+    args = parser.parse_args()
+    if args.command == 'worker' and not args.redis:
+        parser.error("worker needs --redis; without Redis use coordinator --local-workers")
+    if args.command == 'coordinator':
+        run_coordinator(args)
+    else:
+        run_worker(args)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    main()
@@ -0,0 +1,79 @@
+import codecs
+import logging
+import re
+import threading
+from urllib.parse import urlparse
+from requests.compat import chardet
+
+logger = logging.getLogger(__name__)
+
+HEADER_CHARSET_PATTERN = re.compile(r'charset\s*=\s*["\']?\s*([-\w:.]+)', re.I)
+META_CHARSET_PATTERN = re.compile(rb'<meta[^>]+?charset\s*=\s*["\']?\s*([-\w:.]+)', re.I)
+XML_ENCODING_PATTERN = re.compile(rb'<\?xml[^>]+encoding\s*=\s*["\']([-\w:.]+)', re.I)
+
+# GB2312/GBK 都是 GB18030 的子集，统一用 GB18030 解码可以避免生僻字乱码
+ALIASES = {
+    'gb2312': 'gb18030',
+    'gbk': 'gb18030',
+    'cp936': 'gb18030',
+}
+
+def normalize_encoding(name):
+    if not name:
+        return None
+    try:
+        name = codecs.lookup(name.strip().lower()).name
+    except LookupError:
+        return None
+    return ALIASES.get(name, name)
+
+class EncodingResolver:
+    """按开销从低到高确定页面编码。
+
+    依次参考 HTTP 头里的 charset、正文前 sniff_size 字节中的 <meta charset>、同一 host 上次的结果。
+    只有在 HTTP 头和 meta 互相矛盾，或者三者都没有时，才对前 detect_size 字节做统计检测。
+    """
+
+    def __init__(self, sniff_size=4096, detect_size=32 * 1024):
+        self.sniff_size = sniff_size
+        self.detect_size = detect_size
+        self.host_encodings = {}
+        self.detections = 0
+        self._lock = threading.Lock()
+
+    def _from_header(self, content_type):
+        match = HEADER_CHARSET_PATTERN.search(content_type or '')
+        return normalize_encoding(match.group(1)) if match else None
+
+    def _from_meta(self, body):
+        head = body[:self.sniff_size]
+        match = META_CHARSET_PATTERN.search(head) or XML_ENCODING_PATTERN.search(head)
+        return normalize_encoding(match.group(1).decode('ascii', 'ignore')) if match else None
+
+    def _detect(self, body):
+        with self._lock:
+            self.detections += 1
+        try:
+            return normalize_encoding(chardet.detect(body[:self.detect_size])['encoding'])
+        except Exception:
+            return None
+
+    def resolve(self, body, content_type=None, url=None):
+        host = urlparse(url).netloc.lower() if url else None
+        header = self._from_header(content_type)
+        meta = self._from_meta(body)
+
+        if header and meta and header != meta:
+            detected = self._detect(body)
+            encoding = detected if detected in (header, meta) else meta
+            logger.info(f"Charset in header ({header}) and meta ({meta}) disagree for {url}, using {encoding}")
+        else:
+            encoding = header or meta or self.host_encodings.get(host) or self._detect(body) or 'utf-8'
+
+        if host:
+            self.host_encodings[host] = encoding
+        return encoding
+
+    def stats(self):
+        """Gauge for the metrics collector: how many bodies needed statistical detection."""
+        return {"encoding_detections": self.detections}
@@ -1,12 +1,69 @@
 from ebooklib import epub
+from streaming_epub import StreamingEpubWriter, series_metadata
+from pack_store import PackStore
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
 import os
 import uuid
 
+def split_volumes(toc_list, base_dir, max_chapters=None, max_bytes=None, chapter_images=None, store=None):
+    """Cut toc_list into volumes of at most max_chapters chapters and roughly max_bytes of chapter and image files.
+
+    chapter_images maps a chapter file to the image files it references, so images count
+    towards the volume they first appear in. Chapters kept in store count with their
+    compressed size. Repeated chapter files are kept only once.
+    """
+    chapter_images = chapter_images or {}
+
+    def size_of(names):
+        total = 0
+        for name in names:
+            path = os.path.join(base_dir, name)
+            if store is not None and name in store:
+                total += store.size(name)
+            elif os.path.exists(path):
+                total += os.path.getsize(path)
+        return total
+
+    volumes = []
+    volume, volume_bytes, volume_images = [], 0, set()
+    added_files = set()
+    for entry in toc_list:
+        if entry['filename'] in added_files:
+            continue
+        added_files.add(entry['filename'])
+        images = chapter_images.get(entry['filename'], ())
+        size = size_of([entry['filename']] + [image for image in images if image not in volume_images])
+        if volume and ((max_chapters and len(volume) >= max_chapters) or (max_bytes and volume_bytes + size > max_bytes)):
+            volumes.append(volume)
+            volume, volume_bytes, volume_images = [], 0, set()
+            size = size_of([entry['filename']] + list(images))
+        volume.append(entry)
+        volume_bytes += size
+        volume_images.update(images)
+    if volume:
+        volumes.append(volume)
+    return volumes
+
+def volume_title(book_name, language, index):
+    return f"{book_name} 第{index}卷" if language.startswith('zh') else f"{book_name} Vol. {index}"
+
+def _build_volume(base_dir, output_dir, store_path, kwargs):
+    # 在子进程中执行，参数都是可序列化的普通对象，打包文件在子进程中以只读方式重新打开
+    store = PackStore(store_path, readonly=True) if store_path else None
+    try:
+        return EpubGenerator(base_dir, output_dir, store).generate_epub(**kwargs)
+    finally:
+        if store is not None:
+            store.close()
+
 class EpubGenerator:
     
-    def __init__(self, base_dir, output_dir=None):
+    def __init__(self, base_dir, output_dir=None, store=None):
         self.base_dir = base_dir
         self.output_dir = output_dir if output_dir else base_dir
+        # 章节优先从 PackStore 中读取，不在其中的再从 base_dir 下的文件读取
+        self.store = store
         self.IMAGE_EXTENSIONS = {
         '.png': 'image/png',
         '.jpg': 'image/jpeg',
@@ -16,6 +73,14 @@ class EpubGenerator:
 
     def _generate_uuid(self):
         return str(uuid.uuid4())
+
+    def read_chapter(self, chapter_file_name):
+        if self.store is not None:
+            content = self.store.get(chapter_file_name)
+            if content is not None:
+                return content
+        with open(os.path.join(self.base_dir, chapter_file_name), 'r', encoding='utf-8') as f:
+            return f.read()
     
     def add_chapters_to_book(self, book, toc_list):
         chapters = []
@@ -23,12 +88,10 @@ class EpubGenerator:
         for entry in toc_list:
             chapter_title = entry['chapter_title']
             chapter_file_name = entry['filename']
-            chapter_file_path = os.path.join(self.base_dir, chapter_file_name)
             if chapter_file_name in added_files:
                 continue
             try:
-                with open(chapter_file_path, 'r', encoding='utf-8') as f:
-                    chapter_content = f.read()
+                chapter_content = self.read_chapter(chapter_file_name)
                 c = epub.EpubHtml(title=chapter_title, file_name=chapter_file_name, content=chapter_content, media_type="application/xhtml+xml")
                 book.add_item(c)
                 chapters.append(c)
@@ -38,26 +101,44 @@ class EpubGenerator:
                 continue
         return chapters
     
-    def add_images_to_book(self, book):
+    def _image_files(self, exclude=(), image_files=None):
+        if image_files is not None:
+            # 只打包章节实际引用的图片，按清单直接定位文件，不扫描目录
+            for file in image_files:
+                ext = os.path.splitext(file)[1].lower()
+                image_path = os.path.join(self.base_dir, file)
+                if ext not in self.IMAGE_EXTENSIONS or file in exclude:
+                    continue
+                if not os.path.exists(image_path):
+                    print(f"Resource not found: {image_path}")
+                    continue
+                yield file, image_path, self.IMAGE_EXTENSIONS[ext]
+            return
         for root, dirs, files in os.walk(self.base_dir):
             for file in files:
                 ext = os.path.splitext(file)[1].lower()
-                if ext in self.IMAGE_EXTENSIONS:
+                if ext in self.IMAGE_EXTENSIONS and file not in exclude:
                     image_path = os.path.join(root, file)
                     if not os.path.exists(image_path):
                         print(f"Resource not found: {image_path}")
                         continue
-                    img = epub.EpubImage()
-                    img.file_name = file
-                    img.media_type = self.IMAGE_EXTENSIONS[ext]
-                    with open(image_path, 'rb') as f:
-                        img.content = f.read()
-                    book.add_item(img)
+                    yield file, image_path, self.IMAGE_EXTENSIONS[ext]
+
+    def add_images_to_book(self, book, image_files=None):
+        for file, image_path, media_type in self._image_files(exclude={"cover.jpg"}, image_files=image_files):
+            img = epub.EpubImage()
+            img.file_name = file
+            img.media_type = media_type
+            with open(image_path, 'rb') as f:
+                img.content = f.read()
+            book.add_item(img)
                     
-    def generate_epub(self, toc_list, book_name, author, language, epub_name,cover_path,identifier=None):
+    def generate_epub(self, toc_list, book_name, author, language, epub_name,cover_path,identifier=None, streaming=False, image_files=None, series=None):
         print("Generating epub...")
         # 创建保存目录
         os.makedirs(self.output_dir,exist_ok=True)
+        if streaming:
+            return self.generate_epub_streaming(toc_list, book_name, author, language, epub_name, cover_path, identifier, image_files, series)
 
         book = epub.EpubBook()
 
@@ -68,12 +149,14 @@ class EpubGenerator:
         book.set_title(book_name)
         book.set_language(language)
         book.add_author(author)
+        for attributes, text in series_metadata(series):
+            book.add_metadata(None, 'meta', text, attributes)
         with open(cover_path, 'rb') as cover_file:
             book.set_cover("cover.jpg", cover_file.read())
 
         # 使用辅助方法添加章节和图片
         chapters = self.add_chapters_to_book(book, toc_list)
-        self.add_images_to_book(book)
+        self.add_images_to_book(book, image_files)
 
         # 创建导航文档
         nav_doc = epub.EpubNav()
@@ -92,4 +175,61 @@ class EpubGenerator:
 
         print(f"EPUB generated at {epub_path}")
         print(f"EPUB generated at {epub_path_absolute}")
-                
\ No newline at end of file
+        return epub_path_absolute
+
+    def generate_epub_streaming(self, toc_list, book_name, author, language, epub_name, cover_path, identifier=None, image_files=None, series=None):
+        """Write the EPUB one chapter/image at a time so peak memory does not grow with the book."""
+        os.makedirs(self.output_dir, exist_ok=True)
+        if not identifier:
+            identifier = self._generate_uuid()
+        epub_path = os.path.join(self.output_dir, epub_name+'.epub')
+        writer = StreamingEpubWriter(epub_path, identifier, book_name, language, author, series)
+        try:
+            writer.set_cover("cover.jpg", cover_path)
+            added_files = set()
+            for entry in toc_list:
+                chapter_file_name = entry['filename']
+                if chapter_file_name in added_files:
+                    continue
+                try:
+                    writer.add_chapter(entry['chapter_title'], chapter_file_name, self.read_chapter(chapter_file_name))
+                    added_files.add(chapter_file_name)
+                except Exception as e:
+                    print(e)
+                    continue
+            for file, image_path, media_type in self._image_files(exclude={"cover.jpg"}, image_files=image_files):
+                writer.add_image(file, image_path, media_type)
+        finally:
+            writer.close()
+        epub_path_absolute = os.path.abspath(epub_path)
+        print(f"EPUB generated at {epub_path_absolute}")
+        return epub_path_absolute
+
+    def generate_volumes(self, volumes, book_name, author, language, epub_name, cover_path, identifier=None,
+                         streaming=False, image_files=None, max_workers=None):
+        """Build one EPUB per volume in parallel worker processes and return their paths in order.
+
+        Every volume has its own nav and spine, and shares the author, language, cover and a
+        series entry named after the book. image_files is a list with the images of each volume.
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        if not identifier:
+            identifier = self._generate_uuid()
+        width = len(str(len(volumes)))
+        jobs = []
+        for index, toc_list in enumerate(volumes, 1):
+            jobs.append({
+                "toc_list": toc_list, "book_name": volume_title(book_name, language, index), "author": author,
+                "language": language, "epub_name": f"{epub_name}_{index:0{width}d}", "cover_path": cover_path,
+                "identifier": f"{identifier}-{index}", "streaming": streaming,
+                "image_files": image_files[index - 1] if image_files is not None else None,
+                "series": (book_name, index),
+            })
+        if len(jobs) == 1 or max_workers == 1:
+            return [EpubGenerator(self.base_dir, self.output_dir, self.store).generate_epub(**kwargs) for kwargs in jobs]
+        store_path = self.store.path if self.store is not None else None
+        # 调用方进程里还有抓取线程（batch.py 中其他书仍在抓取），用 spawn 避免 fork 带来的锁状态问题
+        with ProcessPoolExecutor(max_workers=min(len(jobs), max_workers or os.cpu_count() or 1),
+                                 mp_context=multiprocessing.get_context('spawn')) as executor:
+            return list(executor.map(_build_volume, [self.base_dir] * len(jobs), [self.output_dir] * len(jobs),
+                                     [store_path] * len(jobs), jobs))
@@ -0,0 +1,124 @@
+import logging
+from bs4 import BeautifulSoup, CData, NavigableString, Tag
+
+logger = logging.getLogger(__name__)
+
+class SoupBackend:
+    """BeautifulSoup 解析后端，CSS 选择器由 soupsieve 实现。
+
+    features 默认使用 lxml，比 html.parser 快得多，选择器语义不变。
+    """
+
+    def __init__(self, features='lxml'):
+        self.features = features
+        self.name = features
+
+    def parse(self, markup):
+        return BeautifulSoup(markup, self.features)
+
+    def select(self, node, selector):
+        return node.select(selector)
+
+    def select_one(self, node, selector):
+        return node.select_one(selector)
+
+    def get_attr(self, node, name):
+        return node.get(name)
+
+    def set_attr(self, node, name, value):
+        node[name] = value
+
+    def text(self, node):
+        return node.text
+
+    def remove(self, node):
+        node.extract()
+
+    def markup(self, node):
+        return str(node)
+
+    def pretty_markup(self, node):
+        return node.prettify()
+
+    def to_etree(self, node):
+        """Copy node into an lxml container for compact_xhtml, without serializing and parsing it again."""
+        from xhtml import append_element, append_text, fragment
+
+        def copy(node, parent):
+            if isinstance(node, Tag):
+                attrs = {name: ' '.join(value) if isinstance(value, list) else value for name, value in node.attrs.items()}
+                # BeautifulSoup 文档本身（[document]）等非法标签名只复制内容
+                target = append_element(parent, node.name, attrs)
+                for child in node.children:
+                    copy(child, parent if target is None else target)
+            elif type(node) in (NavigableString, CData):
+                # 注释、doctype 等其他 NavigableString 子类不属于正文
+                append_text(parent, str(node))
+
+        container = fragment()
+        copy(node, container)
+        return container
+
+class SelectolaxBackend:
+    """selectolax（lexbor）解析后端，速度最快，支持常用的 CSS 选择器。"""
+
+    name = 'selectolax'
+
+    def __init__(self):
+        from selectolax.lexbor import LexborHTMLParser
+        self._parser = LexborHTMLParser
+
+    def parse(self, markup):
+        return self._parser(markup)
+
+    def select(self, node, selector):
+        return node.css(selector)
+
+    def select_one(self, node, selector):
+        return node.css_first(selector)
+
+    def get_attr(self, node, name):
+        return node.attributes.get(name)
+
+    def set_attr(self, node, name, value):
+        node.attrs[name] = value
+
+    def text(self, node):
+        return node.text(deep=True)
+
+    def remove(self, node):
+        node.decompose()
+
+    def markup(self, node):
+        return node.html
+
+    def pretty_markup(self, node):
+        # lexbor 没有与 prettify() 对应的输出，不参与体积抽样
+        return None
+
+    def to_etree(self, node):
+        """Return node as an lxml container for compact_xhtml.
+
+        Unlike SoupBackend the node is serialized and parsed by lxml: both run in C and are
+        faster than copying lexbor nodes one by one in Python.
+        """
+        from lxml import html
+        from xhtml import INVALID_XML_CHARS
+        return html.fragment_fromstring(INVALID_XML_CHARS.sub('', node.html), create_parent='div')
+
+def get_parser(name=None):
+    """Return a parser backend by name ('lxml', 'html.parser' or 'selectolax').
+
+    Without a name the fastest available BeautifulSoup backend is used, so selector
+    semantics stay the same as before.
+    """
+    if name == 'selectolax':
+        return SelectolaxBackend()
+    if name:
+        return SoupBackend(name)
+    try:
+        import lxml
+        return SoupBackend('lxml')
+    except ImportError:
+        logger.warning("lxml is not installed, falling back to the slower html.parser")
+        return SoupBackend('html.parser')
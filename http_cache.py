@@ -0,0 +1,185 @@
+import hashlib
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class HttpCache:
+    """持久化的 HTTP 响应缓存。
+
+    响应体按 URL 的 sha1 存放在 cache_dir/objects 下，索引（ETag、Last-Modified、过期时间、
+    大小、最近访问时间）存放在 sqlite 中。总大小超过 max_size 时按最近访问时间淘汰（LRU）。
+    """
+
+    def __init__(self, cache_dir='cache', max_size=1024 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.objects_dir = os.path.join(cache_dir, 'objects')
+        self.max_size = max_size
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(cache_dir, 'index.db'), check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                url TEXT PRIMARY KEY,
+                key TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                expires REAL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL,
+                content_type TEXT
+            )""")
+        # 较早版本创建的索引没有 content_type 列
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(entries)")]
+        if 'content_type' not in columns:
+            self._db.execute("ALTER TABLE entries ADD COLUMN content_type TEXT")
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+        self._db.commit()
+        self.total_size = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def _object_path(self, key):
+        return os.path.join(self.objects_dir, key)
+
+    def get(self, url):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT key, etag, last_modified, expires, content_type FROM entries WHERE url = ?", (url,)).fetchone()
+        if not row:
+            self.misses += 1
+            return None
+        key, etag, last_modified, expires, content_type = row
+        path = self._object_path(key)
+        if not os.path.exists(path):
+            self.delete(url)
+            self.misses += 1
+            return None
+        return {"url": url, "path": path, "etag": etag, "last_modified": last_modified, "expires": expires,
+                "content_type": content_type}
+
+    def is_fresh(self, entry):
+        return bool(entry["expires"]) and entry["expires"] > time.time()
+
+    def conditional_headers(self, entry):
+        headers = {}
+        if entry["etag"]:
+            headers['If-None-Match'] = entry["etag"]
+        if entry["last_modified"]:
+            headers['If-Modified-Since'] = entry["last_modified"]
+        return headers
+
+    def hit(self, entry, revalidated=False):
+        """记录一次命中（新鲜命中或 304），并刷新 LRU 时间。"""
+        if revalidated:
+            self.revalidated += 1
+        else:
+            self.hits += 1
+        with self._lock:
+            self._db.execute("UPDATE entries SET last_access = ? WHERE url = ?", (time.time(), entry["url"]))
+            self._db.commit()
+
+    def read(self, entry):
+        with open(entry["path"], 'rb') as f:
+            return f.read()
+
+    def copy_to(self, entry, save_path):
+        shutil.copyfile(entry["path"], save_path)
+
+    def refresh(self, entry, headers):
+        """304 响应可能带来新的缓存头，更新过期时间与校验值。"""
+        validators = self._validators(headers)
+        if validators is None:
+            return
+        etag, last_modified, expires = validators
+        with self._lock:
+            self._db.execute(
+                "UPDATE entries SET etag = COALESCE(?, etag), last_modified = COALESCE(?, last_modified), expires = ? WHERE url = ?",
+                (etag, last_modified, expires, entry["url"]))
+            self._db.commit()
+
+    def _validators(self, headers):
+        cache_control = headers.get('Cache-Control', '').lower()
+        if 'no-store' in cache_control:
+            return None
+        etag = headers.get('ETag')
+        last_modified = headers.get('Last-Modified')
+        expires = None
+        match = re.search(r'max-age=(\d+)', cache_control)
+        if match and 'no-cache' not in cache_control:
+            expires = time.time() + int(match.group(1))
+        if not (etag or last_modified or expires):
+            # 既不能重新验证也没有有效期，缓存了也用不上
+            return None
+        return etag, last_modified, expires
+
+    def store(self, url, body, headers):
+        return self._store(url, headers, lambda path: self._write(path, body))
+
+    def store_file(self, url, file_path, headers):
+        return self._store(url, headers, lambda path: shutil.copyfile(file_path, path))
+
+    def _write(self, path, body):
+        with open(path, 'wb') as f:
+            f.write(body)
+
+    def _store(self, url, headers, writer):
+        validators = self._validators(headers)
+        if validators is None:
+            return False
+        etag, last_modified, expires = validators
+        key = hashlib.sha1(url.encode()).hexdigest()
+        path = self._object_path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            writer(tmp_path)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.error(f"Failed to write cache entry for {url}. Error: {e}")
+            return False
+        size = os.path.getsize(path)
+        with self._lock:
+            row = self._db.execute("SELECT size FROM entries WHERE url = ?", (url,)).fetchone()
+            self.total_size += size - (row[0] if row else 0)
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (url, key, etag, last_modified, expires, size, last_access, content_type) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (url, key, etag, last_modified, expires, size, time.time(), headers.get('Content-Type')))
+            self._db.commit()
+            self._evict()
+        return True
+
+    def delete(self, url):
+        with self._lock:
+            row = self._db.execute("SELECT key, size FROM entries WHERE url = ?", (url,)).fetchone()
+            if row:
+                self._remove(url, *row)
+                self._db.commit()
+
+    def _remove(self, url, key, size):
+        self._db.execute("DELETE FROM entries WHERE url = ?", (url,))
+        self.total_size -= size
+        try:
+            os.remove(self._object_path(key))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        if self.total_size <= self.max_size:
+            return
+        rows = self._db.execute("SELECT url, key, size FROM entries ORDER BY last_access").fetchall()
+        for url, key, size in rows:
+            if self.total_size <= self.max_size:
+                break
+            self._remove(url, key, size)
+            logger.info(f"Evicted {url} from cache")
+        self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,156 @@
+import logging
+import threading
+from contextlib import contextmanager
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """连接池大小可配置的 HTTPAdapter，并统计连接的复用情况。
+
+    requests 默认每个 host 只保留 10 个空闲连接，并发线程更多时多出来的连接用完即关，
+    下一次请求要重新建立连接和 TLS 握手。pool_maxsize 应不小于同时访问同一 host 的线程数。
+    """
+
+    def __init__(self, pool_connections=32, pool_maxsize=128):
+        self._disposed = {"requests": 0, "connections": 0}
+        self._lock = threading.Lock()
+        super().__init__(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+
+    def _dispose(self, pool):
+        # host 数超过 pool_connections 时最久未用的连接池会被关闭，先把它的计数累加下来
+        with self._lock:
+            self._disposed["requests"] += pool.num_requests
+            self._disposed["connections"] += pool.num_connections
+        pool.close()
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pools.dispose_func = self._dispose
+
+    def _pools(self):
+        managers = [self.poolmanager] + list(self.proxy_manager.values())
+        for manager in managers:
+            for key in list(manager.pools.keys()):
+                pool = manager.pools.get(key)
+                if pool is not None:
+                    yield pool
+
+    def stats(self):
+        """Return how many requests were sent and how many connections were opened for them."""
+        with self._lock:
+            totals = dict(self._disposed)
+        for pool in self._pools():
+            totals["requests"] += pool.num_requests
+            totals["connections"] += pool.num_connections
+        return totals
+
+class Http2Response:
+    """把 httpx 的响应包装成 Crawler 用到的 requests.Response 接口。
+
+    stream=True 时正文不预先读入内存，由 iter_content 边下载边返回，读完后释放连接上的流。
+    """
+
+    def __init__(self, response, stream=False, errors=None):
+        self._response = response
+        self._errors = errors
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.url = str(response.url)
+        self.http_version = response.http_version
+        if stream and not 200 <= self.status_code < 300:
+            # 错误和 304 响应调用方不会读取正文，立即读完以释放流
+            self._read()
+
+    def _read(self):
+        with self._errors():
+            return self._response.read()
+
+    @property
+    def content(self):
+        return self._read()
+
+    def iter_content(self, chunk_size=8192):
+        if self._response.is_stream_consumed:
+            for start in range(0, len(self._response.content), chunk_size):
+                yield self._response.content[start:start + chunk_size]
+            return
+        try:
+            with self._errors():
+                yield from self._response.iter_bytes(chunk_size)
+        finally:
+            self._response.close()
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} Error for url: {self.url}", response=self)
+
+class Http2Session:
+    """基于 httpx 的 HTTP/2 传输，同一 host 的请求在少量长连接上多路复用。
+
+    接口与 requests.Session.request 相同，异常转换为对应的 requests 异常，Crawler 的重试、
+    限速和流式下载逻辑不需要区分传输方式。httpx 的代理是按客户端设置的，不支持按请求传入 proxies，
+    带代理的请求由 Crawler 交给 requests 发送。
+    """
+
+    def __init__(self, pool_size=128, keepalive_expiry=60):
+        import httpx
+        self._httpx = httpx
+        # requests 默认跟随重定向，httpx 默认不跟随；不打开的话 301/302 的章节和目录页会得到空正文
+        self.client = httpx.Client(http2=True, follow_redirects=True, limits=httpx.Limits(max_connections=pool_size,
+                                   max_keepalive_connections=pool_size, keepalive_expiry=keepalive_expiry))
+        self.counts = {"requests": 0, "connections": 0}
+        self._lock = threading.Lock()
+
+    def _trace(self, event_name, info):
+        if event_name == 'connection.connect_tcp.complete':
+            with self._lock:
+                self.counts["connections"] += 1
+
+    @contextmanager
+    def _errors(self):
+        httpx = self._httpx
+        try:
+            yield
+        except httpx.TimeoutException as e:
+            raise requests.Timeout(str(e) or type(e).__name__) from e
+        except httpx.TransportError as e:
+            raise requests.ConnectionError(str(e) or type(e).__name__) from e
+        except httpx.TooManyRedirects as e:
+            raise requests.TooManyRedirects(str(e) or type(e).__name__) from e
+        except httpx.DecodingError as e:
+            raise requests.exceptions.ContentDecodingError(str(e) or type(e).__name__) from e
+        except httpx.HTTPError as e:
+            raise requests.RequestException(str(e) or type(e).__name__) from e
+
+    def request(self, method, url, headers=None, timeout=None, stream=False, proxies=None, **kwargs):
+        if proxies:
+            raise ValueError("Http2Session does not support per-request proxies")
+        httpx = self._httpx
+        if isinstance(timeout, tuple):
+            timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+        with self._errors():
+            request = self.client.build_request(method, url, headers=headers, timeout=timeout,
+                                                extensions={"trace": self._trace}, **kwargs)
+            response = self.client.send(request, stream=stream)
+        with self._lock:
+            self.counts["requests"] += 1
+        return Http2Response(response, stream, self._errors)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts)
+
+    def close(self):
+        self.client.close()
+
+def reuse_stats(counts, prefix='http'):
+    """Turn {'requests', 'connections'} counts into the gauges exported with the metrics."""
+    requests_sent, connections = counts["requests"], counts["connections"]
+    return {
+        f"{prefix}_requests_sent": requests_sent,
+        f"{prefix}_connections_opened": connections,
+        f"{prefix}_connections_reused": max(0, requests_sent - connections),
+        f"{prefix}_connection_reuse_ratio": 1 - connections / requests_sent if requests_sent else 0.0,
+    }
@@ -0,0 +1,43 @@
+import logging
+import os
+import threading
+import yaml
+
+logger = logging.getLogger(__name__)
+
+class ImageManifest:
+    """记录每个章节文件引用了哪些图片文件。
+
+    下载阶段写入，EPUB 生成阶段据此只打包书中实际引用的图片，不再遍历 tmp 目录。
+    清单保存在 yaml 文件中，中断后继续抓取时已完成章节的记录不会丢失。
+    """
+
+    def __init__(self, path='tmp/images.yaml'):
+        self.path = path
+        self.chapters = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.chapters = yaml.safe_load(f) or {}
+
+    def record(self, chapter_filename, image_filenames):
+        with self._lock:
+            self.chapters[chapter_filename] = sorted(set(image_filenames))
+
+    def images_for(self, chapter_filenames):
+        """Return the image files referenced by the given chapters, in first-use order."""
+        images = {}
+        with self._lock:
+            for chapter_filename in chapter_filenames:
+                for image_filename in self.chapters.get(chapter_filename, ()):
+                    images[image_filename] = None
+        return list(images)
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            with open(self.path, 'w', encoding='utf-8') as f:
+                yaml.safe_dump(self.chapters, f, allow_unicode=True)
+        logger.info(f"Image manifest saved to {self.path}")
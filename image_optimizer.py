@@ -0,0 +1,71 @@
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# 常见 6~7 寸墨水屏的分辨率
+DEFAULT_MAX_SIZE = (1264, 1680)
+
+def optimize_image(path, max_size=DEFAULT_MAX_SIZE, quality=80, grayscale=False, min_saving=0.1):
+    """Downscale and recompress one image in place.
+
+    Metadata is dropped because the image is re-encoded without it. The file is only replaced
+    when the result is at least min_saving smaller, so running the optimizer again on its own
+    output does not keep recompressing the same JPEG. Returns (bytes_before, bytes_after).
+    """
+    before = os.path.getsize(path)
+    try:
+        with Image.open(path) as image:
+            image_format = image.format
+            if image_format not in ('JPEG', 'PNG'):
+                return before, before
+            image.thumbnail(max_size, Image.LANCZOS)
+            if grayscale:
+                image = image.convert('LA' if image_format == 'PNG' and 'A' in image.getbands() else 'L')
+            elif image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            tmp_path = path + '.opt'
+            if image_format == 'JPEG':
+                image.save(tmp_path, 'JPEG', quality=quality, optimize=True, progressive=True)
+            else:
+                image.save(tmp_path, 'PNG', optimize=True)
+    except Exception as e:
+        logger.error(f"Failed to optimize image {path}. Error: {e}")
+        return before, before
+
+    after = os.path.getsize(tmp_path)
+    if after <= before * (1 - min_saving):
+        os.replace(tmp_path, path)
+        return before, after
+    os.remove(tmp_path)
+    return before, before
+
+def _optimize_image(args):
+    return optimize_image(*args)
+
+class ImageOptimizer:
+    """把图片缩放、重新压缩到适合电子阅读器的大小，在进程池中并行执行。"""
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, quality=80, grayscale=False, max_workers=None):
+        self.max_size = max_size
+        self.quality = quality
+        self.grayscale = grayscale
+        self.max_workers = max_workers
+
+    def optimize(self, paths):
+        paths = sorted(set(paths))
+        stats = {"images": len(paths), "bytes_before": 0, "bytes_after": 0, "bytes_saved": 0}
+        if not paths:
+            return stats
+        jobs = [(path, self.max_size, self.quality, self.grayscale) for path in paths]
+        # batch.py 中其他书的抓取线程仍在运行，用 spawn 避免 fork 带来的锁状态问题
+        with ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            for before, after in executor.map(_optimize_image, jobs, chunksize=8):
+                stats["bytes_before"] += before
+                stats["bytes_after"] += after
+        stats["bytes_saved"] = stats["bytes_before"] - stats["bytes_after"]
+        logger.info(f"Optimized {stats['images']} images, saved {stats['bytes_saved']} bytes")
+        return stats
@@ -0,0 +1,177 @@
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from timeout_policy import remaining
+
+logger = logging.getLogger(__name__)
+
+class ImageScheduler:
+    """整个抓取过程共用的图片下载队列。
+
+    下载前按 URL 去重：同一个 URL 只下载一次，之后的请求直接复用同一个 Future。
+    下载后按内容哈希去重：不同 URL 的相同图片（横幅、头像等）只保存一份，文件名为内容的 sha1。
+    resolve 返回 URL 到文件名的映射，章节据此改写 img 的 src。
+    设置了 retry_scheduler 时每次只尝试一次，失败的图片进入延迟队列，不在下载线程中等待重试。
+    """
+
+    def __init__(self, crawler, utility, state=None, max_workers=64, max_retries=3, base_dir='tmp', retry_scheduler=None):
+        self.crawler = crawler
+        self.utility = utility
+        self.state = state
+        self.base_dir = base_dir
+        self.max_retries = 1 if retry_scheduler else max_retries
+        self.retry_scheduler = retry_scheduler
+        self.fetch_options = {'retries': 0} if retry_scheduler else {}
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.futures = {}
+        self.by_hash = {}
+        self.saved_paths = set()
+        self.duplicates = 0
+        self.pending = 0
+        self.metrics = crawler.metrics
+        self._lock = threading.Lock()
+
+    def submit(self, url):
+        """Schedule url for download and return a Future resolving to the saved filename (or None)."""
+        with self._lock:
+            future = self.futures.get(url)
+            if future is not None:
+                return future
+            future = self.futures[url] = Future()
+            self.pending += 1
+            future.add_done_callback(self._finished)
+            self.metrics.queue_depth('images', self.pending)
+        self._attempt(url, future)
+        return future
+
+    def _attempt(self, url, future):
+        try:
+            if self.crawler.is_async:
+                attempt = asyncio.run_coroutine_threadsafe(self._download_async(url), self.crawler.loop)
+            else:
+                attempt = self.executor.submit(self._download, url)
+        except RuntimeError:
+            # 延迟重试到期时抓取已经结束，executor 已关闭
+            future.set_result(self._failed(url))
+            return
+        attempt.add_done_callback(lambda done: self._attempted(url, future, done))
+
+    def _attempted(self, url, future, attempt):
+        try:
+            filename = attempt.result()
+        except Exception as e:
+            logger.error(f"Failed to fetch_image from {url}. Error: {e}")
+            filename = None
+        if filename is None:
+            if self.retry_scheduler and self.retry_scheduler.defer(url, lambda: self._attempt(url, future), park=False):
+                return
+            filename = self._failed(url)
+        future.set_result(filename)
+
+    def _finished(self, future):
+        with self._lock:
+            self.pending -= 1
+            self.metrics.queue_depth('images', self.pending)
+
+    def resolve(self, urls, deadline=None):
+        """Download urls (deduplicated) and return a {url: filename} mapping of the ones that succeeded.
+
+        The calling chapter thread waits for its images, including ones waiting in the retry
+        scheduler, because the chapter is saved with the filenames filled in. The wait is bounded
+        by the deadline: TimeoutError is raised when it passes first, and the downloads keep
+        running for other chapters.
+        """
+        futures = {url: self.submit(url) for url in set(urls)}
+        mapping = {}
+        for url, future in futures.items():
+            filename = future.result(timeout=remaining(deadline))
+            if filename:
+                mapping[url] = filename
+        return mapping
+
+    async def resolve_async(self, urls):
+        # shield：文章超时被取消时不能连带取消其他章节也在等待的图片下载
+        futures = {url: asyncio.shield(asyncio.wrap_future(self.submit(url))) for url in set(urls)}
+        filenames = await asyncio.gather(*futures.values())
+        return {url: filename for url, filename in zip(futures, filenames) if filename}
+
+    def _saved_filename(self, url):
+        saved_path = self.state.image_path(url) if self.state else None
+        if not saved_path:
+            return None
+        with self._lock:
+            self.saved_paths.add(saved_path)
+        return os.path.basename(saved_path)
+
+    def _download(self, url):
+        filename = self._saved_filename(url)
+        if filename:
+            return filename
+        part_path = self.utility.generate_image_save_path(url, self.base_dir) + '.part'
+        with self.metrics.timer('image'):
+            for attempt in range(self.max_retries):
+                try:
+                    if self.crawler.fetch_image(url, part_path, **self.fetch_options):
+                        return self._store(url, part_path)
+                    logger.warning(f"Failed to fetch_image from {url}. ({attempt + 1}/{self.max_retries})")
+                except Exception as e:
+                    logger.error(f"Failed to fetch_image from {url}. Error: {e}. ({attempt + 1}/{self.max_retries})")
+            self._discard(part_path)
+            return None
+
+    async def _download_async(self, url):
+        filename = self._saved_filename(url)
+        if filename:
+            return filename
+        part_path = self.utility.generate_image_save_path(url, self.base_dir) + '.part'
+        with self.metrics.timer('image'):
+            try:
+                if await self.crawler.afetch_image(url, part_path, **self.fetch_options):
+                    return self._store(url, part_path)
+            except Exception as e:
+                logger.error(f"Failed to fetch_image from {url}. Error: {e}")
+            self._discard(part_path)
+            return None
+
+    def _discard(self, part_path):
+        if os.path.exists(part_path):
+            os.remove(part_path)
+
+    def _failed(self, url):
+        logger.error(f"Failed to download image from {url}. Skipping...")
+        self.metrics.incr('images_failed')
+        if self.state:
+            self.state.mark_image(url, None, error="download failed")
+        return None
+
+    def _store(self, url, part_path):
+        with open(part_path, 'rb') as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        url_path = self.utility.generate_image_save_path(url, self.base_dir)
+        extension = os.path.splitext(url_path)[1]
+        save_path = os.path.join(os.path.dirname(url_path), digest + extension)
+        with self._lock:
+            existing = self.by_hash.get(digest)
+            if existing:
+                self.duplicates += 1
+                self.metrics.incr('images_duplicate')
+            else:
+                self.by_hash[digest] = os.path.basename(save_path)
+                self.saved_paths.add(save_path)
+        if existing:
+            os.remove(part_path)
+            save_path = os.path.join(os.path.dirname(url_path), existing)
+            logger.info(f"Image from {url} is a duplicate of {existing}")
+        else:
+            os.replace(part_path, save_path)
+            logger.info(f"Image downloaded from {url}")
+        if self.state:
+            self.state.mark_image(url, save_path)
+        self.metrics.incr('images_done')
+        return os.path.basename(save_path)
+
+    def shutdown(self):
+        self.executor.shutdown()
@@ -0,0 +1,240 @@
+import bisect
+import json
+import logging
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class Histogram:
+    """固定桶的耗时直方图，分位数按桶上界估算。"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self, other):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.count += other.count
+        self.sum += other.sum
+
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def snapshot(self):
+        return {"count": self.count, "seconds": self.sum,
+                "mean": self.sum / self.count if self.count else 0.0,
+                "p50": self.quantile(0.5), "p95": self.quantile(0.95), "p99": self.quantile(0.99)}
+
+class Metrics:
+    """一次抓取过程中的计数器、耗时直方图和队列深度。
+
+    Crawler 记录每个请求的耗时（按 host 和状态码）、传输字节数和重试次数，
+    下载流程记录各阶段（toc、fetch、parse、image、save、epub）的耗时和队列深度。
+    所有方法都是线程安全的，协程中也可以直接调用。
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.counters = {}
+        self.stages = {}
+        self.requests = {}
+        self.bytes_by_host = {}
+        self.queues = {}
+        self.collectors = []
+        self._lock = threading.Lock()
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe_stage(self, stage, seconds):
+        with self._lock:
+            self.stages.setdefault(stage, Histogram()).observe(seconds)
+
+    @contextmanager
+    def timer(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_stage(stage, time.perf_counter() - started)
+
+    def observe_request(self, url, status, seconds):
+        """Record one HTTP attempt; status is the response code or 'timeout' / 'error'."""
+        key = (urlparse(url).netloc, str(status))
+        with self._lock:
+            self.requests.setdefault(key, Histogram()).observe(seconds)
+
+    def add_bytes(self, url, size):
+        host = urlparse(url).netloc
+        with self._lock:
+            self.bytes_by_host[host] = self.bytes_by_host.get(host, 0) + size
+
+    def queue_depth(self, name, depth):
+        with self._lock:
+            current = self.queues.setdefault(name, {"depth": 0, "max": 0})
+            current["depth"] = depth
+            current["max"] = max(current["max"], depth)
+
+    def add_collector(self, collect):
+        """Register a callable returning {name: value} gauges that are read whenever a snapshot is taken.
+
+        A value may also be a {host: value} dict, exported as one gauge per host.
+        """
+        with self._lock:
+            self.collectors.append(collect)
+
+    def gauges(self):
+        with self._lock:
+            collectors = list(self.collectors)
+        gauges = {}
+        for collect in collectors:
+            try:
+                gauges.update(collect())
+            except Exception as e:
+                logger.debug(f"Metrics collector failed: {e}")
+        return gauges
+
+    def _merged(self, index):
+        merged = {}
+        for key, histogram in self.requests.items():
+            merged.setdefault(key[index], Histogram()).merge(histogram)
+        return {name: histogram.snapshot() for name, histogram in sorted(merged.items())}
+
+    def snapshot(self):
+        gauges = self.gauges()
+        with self._lock:
+            return {
+                "elapsed": time.time() - self.started,
+                "counters": dict(self.counters),
+                "stages": {stage: histogram.snapshot() for stage, histogram in self.stages.items()},
+                "requests_by_host": self._merged(0),
+                "requests_by_status": self._merged(1),
+                "bytes": sum(self.bytes_by_host.values()),
+                "bytes_by_host": dict(self.bytes_by_host),
+                "queues": {name: dict(queue) for name, queue in self.queues.items()},
+                "gauges": gauges,
+            }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2, ensure_ascii=False)
+
+    def to_prometheus(self, prefix='web2book'):
+        """Render the metrics in the Prometheus text exposition format."""
+        lines = []
+        gauges = self.gauges()
+
+        def histogram(name, help_text, histograms):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} histogram")
+            for labels, h in histograms:
+                label_text = ','.join(f'{key}="{value}"' for key, value in labels)
+                cumulative = 0
+                for bound, count in zip(h.buckets + (float('inf'),), h.counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else bound
+                    lines.append(f'{prefix}_{name}_bucket{{{label_text},le="{le}"}} {cumulative}')
+                lines.append(f'{prefix}_{name}_sum{{{label_text}}} {h.sum}')
+                lines.append(f'{prefix}_{name}_count{{{label_text}}} {h.count}')
+
+        with self._lock:
+            histogram("stage_duration_seconds", "Time spent in each pipeline stage.",
+                      [((("stage", stage),), h) for stage, h in sorted(self.stages.items())])
+            histogram("request_duration_seconds", "HTTP request latency by host and status.",
+                      [((("host", host), ("status", status)), h) for (host, status), h in sorted(self.requests.items())])
+            lines.append(f"# TYPE {prefix}_bytes_total counter")
+            for host, size in sorted(self.bytes_by_host.items()):
+                lines.append(f'{prefix}_bytes_total{{host="{host}"}} {size}')
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"# TYPE {prefix}_{name}_total counter")
+                lines.append(f"{prefix}_{name}_total {value}")
+            for field, metric in (("depth", "queue_depth"), ("max", "queue_depth_max")):
+                lines.append(f"# TYPE {prefix}_{metric} gauge")
+                for name, queue in sorted(self.queues.items()):
+                    lines.append(f'{prefix}_{metric}{{queue="{name}"}} {queue[field]}')
+            for name, value in sorted(gauges.items()):
+                lines.append(f"# TYPE {prefix}_{name} gauge")
+                if isinstance(value, dict):
+                    for host, host_value in sorted(value.items()):
+                        lines.append(f'{prefix}_{name}{{host="{host}"}} {host_value}')
+                else:
+                    lines.append(f"{prefix}_{name} {value}")
+        return '\n'.join(lines) + '\n'
+
+    def export(self, path):
+        """Write a snapshot to path; a .prom or .txt extension selects the Prometheus format, anything else JSON."""
+        text = self.to_prometheus() if path.endswith(('.prom', '.txt')) else self.to_json()
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        logger.info(f"Metrics exported to {path}")
+        return path
+
+    def progress_line(self):
+        snapshot = self.snapshot()
+        counters = snapshot["counters"]
+        elapsed = snapshot["elapsed"]
+        done = counters.get("chapters_done", 0)
+        failed = counters.get("chapters_failed", 0)
+        queued = counters.get("chapters_queued", 0)
+        megabytes = snapshot["bytes"] / 1024 / 1024
+        queues = ' '.join(f"{name}={queue['depth']}" for name, queue in snapshot["queues"].items())
+        return (f"[{elapsed:6.1f}s] chapters {done + failed}/{queued} ({done / elapsed if elapsed else 0:.1f}/s, {failed} failed) "
+                f"images {counters.get('images_done', 0)} | {megabytes:.1f} MB ({megabytes / elapsed if elapsed else 0:.2f} MB/s) "
+                f"| retries {counters.get('retries', 0) + counters.get('retries_deferred', 0)}" + (f" | queues {queues}" if queues else ''))
+
+class ProgressReporter:
+    """在后台线程中每隔 interval 秒刷新一行进度。"""
+
+    def __init__(self, metrics, interval=1.0, stream=None):
+        self.metrics = metrics
+        self.interval = interval
+        self.stream = stream if stream else sys.stderr
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._write()
+
+    def _write(self, end=''):
+        self.stream.write('\r' + self.metrics.progress_line() + end)
+        self.stream.flush()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self._write(end='\n')
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,149 @@
+import logging
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+logger = logging.getLogger(__name__)
+
+# 数据文件中每条记录：key 长度、压缩后内容长度、key、zlib 压缩的内容
+RECORD_HEADER = struct.Struct('>HI')
+# 索引文件中每条记录：内容在数据文件中的偏移、长度、key 长度，后接 key
+INDEX_ENTRY = struct.Struct('>QIH')
+
+class PackStore:
+    """把章节保存在一个只追加的压缩数据文件中，取代 tmp/ 下每章一个小文件。
+
+    数据文件 path 保存压缩后的内容，path + '.idx' 保存每个 key 的偏移和长度。读取时通过 mmap
+    直接定位，不需要为每章打开文件。同一个 key 再次写入时追加新记录，索引指向最新的一条。
+    打开时以数据文件为准校验索引：补上索引缺失的记录，截掉中断写入留下的残缺记录。
+    """
+
+    def __init__(self, path='tmp/chapters.pack', compress_level=6, readonly=False):
+        self.path = path
+        self.index_path = path + '.idx'
+        self.compress_level = compress_level
+        self.readonly = readonly
+        self.index = {}
+        self._lock = threading.Lock()
+        self._mmap = None
+        if not readonly:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            open(path, 'ab').close()
+        self._data = open(path, 'rb' if readonly else 'r+b')
+        self._end = self._load_index()
+        if not readonly:
+            self._index_file = open(self.index_path, 'ab')
+            self._write_index(self._recover())
+
+    def _load_index(self):
+        """Read the index file and return the end offset of the last record it covers."""
+        size = os.fstat(self._data.fileno()).st_size
+        end = 0
+        if not os.path.exists(self.index_path):
+            return end
+        with open(self.index_path, 'rb') as f:
+            raw = f.read()
+        position = 0
+        while position + INDEX_ENTRY.size <= len(raw):
+            offset, length, key_length = INDEX_ENTRY.unpack_from(raw, position)
+            key_end = position + INDEX_ENTRY.size + key_length
+            if key_end > len(raw) or offset + length > size:
+                break
+            self.index[raw[position + INDEX_ENTRY.size:key_end].decode('utf-8')] = (offset, length)
+            end = max(end, offset + length)
+            position = key_end
+        if position != len(raw) and not self.readonly:
+            # 索引末尾有残缺的条目，按已读取的部分重写
+            with open(self.index_path, 'wb') as f:
+                f.write(raw[:position])
+        return end
+
+    def _recover(self):
+        """Index records that were written to the data file but not to the index file."""
+        size = os.fstat(self._data.fileno()).st_size
+        recovered = []
+        self._data.seek(self._end)
+        while self._end + RECORD_HEADER.size <= size:
+            key_length, length = RECORD_HEADER.unpack(self._data.read(RECORD_HEADER.size))
+            offset = self._end + RECORD_HEADER.size + key_length
+            if offset + length > size:
+                break
+            key = self._data.read(key_length).decode('utf-8')
+            self._data.seek(length, os.SEEK_CUR)
+            recovered.append((key, offset, length))
+            self._end = offset + length
+        if size > self._end:
+            logger.warning(f"Discarding {size - self._end} bytes of an incomplete record at the end of {self.path}")
+            self._data.truncate(self._end)
+        self._data.seek(self._end)
+        return recovered
+
+    def _write_index(self, entries):
+        for key, offset, length in entries:
+            key_bytes = key.encode('utf-8')
+            self._index_file.write(INDEX_ENTRY.pack(offset, length, len(key_bytes)) + key_bytes)
+            self.index[key] = (offset, length)
+        self._index_file.flush()
+
+    def put(self, key, content):
+        """Compress and append content (str or bytes) under key; return the compressed size."""
+        data = content.encode('utf-8') if isinstance(content, str) else content
+        blob = zlib.compress(data, self.compress_level)
+        key_bytes = key.encode('utf-8')
+        with self._lock:
+            offset = self._end + RECORD_HEADER.size + len(key_bytes)
+            self._data.write(RECORD_HEADER.pack(len(key_bytes), len(blob)) + key_bytes + blob)
+            self._data.flush()
+            self._end = offset + len(blob)
+            self._write_index([(key, offset, len(blob))])
+        return len(blob)
+
+    def _view(self, offset, length):
+        if self._mmap is None or offset + length > len(self._mmap):
+            if self._mmap is not None:
+                self._mmap.close()
+            self._mmap = mmap.mmap(self._data.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mmap[offset:offset + length]
+
+    def get_bytes(self, key):
+        with self._lock:
+            location = self.index.get(key)
+            if location is None:
+                return None
+            blob = self._view(*location)
+        return zlib.decompress(blob)
+
+    def get(self, key):
+        """Return the text stored under key, or None."""
+        data = self.get_bytes(key)
+        return data.decode('utf-8') if data is not None else None
+
+    def size(self, key):
+        """Compressed size of the record for key, or None."""
+        location = self.index.get(key)
+        return location[1] if location else None
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def close(self):
+        with self._lock:
+            if self._mmap is not None:
+                self._mmap.close()
+                self._mmap = None
+            if not self.readonly:
+                self._index_file.close()
+            self._data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
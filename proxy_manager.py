@@ -0,0 +1,138 @@
+import logging
+import random
+import threading
+import requests
+
+logger = logging.getLogger(__name__)
+
+class ProxyManager:
+    """代理池客户端：批量预取代理并按健康度挑选。
+
+    代理按批从代理池取回并缓存在本地，剩余可用数量低于 min_available 时在后台线程补充，
+    请求路径上不再额外访问代理池。每个代理有一个健康分，成功时回升、失败时减半，
+    连续失败 max_failures 次的代理会被拉黑，之后从代理池取回也会被忽略。
+    挑选时的权重为健康分乘以典型延迟与该代理延迟之比，越快的代理被选中的概率越高。
+    本地没有代理时最多等待 max_wait 秒，仍然没有就返回 None，请求直接发出。
+    """
+
+    def __init__(self, pool_url, batch_size=20, min_available=5, max_failures=3, batch_url=None, timeout=5, max_wait=2):
+        self.pool_url = pool_url
+        self.batch_size = batch_size
+        self.min_available = min_available
+        self.max_failures = max_failures
+        # germey/proxypool 的 /all 接口一次返回全部代理
+        if batch_url is None and pool_url.rstrip('/').endswith('/random'):
+            batch_url = pool_url.rstrip('/')[:-len('random')] + 'all'
+        self.batch_url = batch_url
+        self.timeout = timeout
+        self.max_wait = max_wait
+        self.proxies = {}
+        self.banned = set()
+        self._lock = threading.Lock()
+        self._refilling = False
+        self._refilled = threading.Event()
+
+    def _fetch_batch(self):
+        addresses = []
+        if self.batch_url:
+            try:
+                response = requests.get(self.batch_url, timeout=self.timeout)
+                response.raise_for_status()
+                addresses = [line.strip() for line in response.text.splitlines() if line.strip()]
+            except requests.RequestException as e:
+                logger.warning(f"Failed to fetch proxies from {self.batch_url}. Error: {e}. Falling back to {self.pool_url}")
+                self.batch_url = None
+        if not addresses:
+            for _ in range(self.batch_size):
+                try:
+                    address = requests.get(self.pool_url, timeout=self.timeout).text.strip()
+                except requests.RequestException as e:
+                    logger.error(f"Failed to fetch proxy from {self.pool_url}. Error: {e}")
+                    break
+                if address:
+                    addresses.append(address)
+        return addresses
+
+    def _refill(self):
+        try:
+            addresses = self._fetch_batch()
+            with self._lock:
+                added = 0
+                for address in addresses:
+                    if address not in self.banned and address not in self.proxies:
+                        self.proxies[address] = {"score": 1.0, "failures": 0, "successes": 0, "latency": None}
+                        added += 1
+            logger.info(f"Added {added} proxies, {len(self.proxies)} available")
+        finally:
+            with self._lock:
+                self._refilling = False
+            self._refilled.set()
+
+    def _start_refill(self):
+        with self._lock:
+            if self._refilling:
+                return
+            self._refilling = True
+            self._refilled.clear()
+        threading.Thread(target=self._refill, daemon=True).start()
+
+    def _weights(self, addresses):
+        latencies = sorted(proxy["latency"] for proxy in self.proxies.values() if proxy["latency"] is not None)
+        # 还没有延迟样本的代理按中位数计算，新代理也有机会被选中
+        typical = latencies[len(latencies) // 2] if latencies else 1.0
+        weights = []
+        for address in addresses:
+            proxy = self.proxies[address]
+            latency = proxy["latency"] if proxy["latency"] is not None else typical
+            weights.append(proxy["score"] * typical / max(latency, 0.01))
+        return weights
+
+    def get(self):
+        """Return a proxy address weighted by health score and latency, or None for a direct request.
+
+        Waits at most max_wait seconds when no proxy is available.
+        """
+        with self._lock:
+            available = len(self.proxies)
+        if available < self.min_available:
+            self._start_refill()
+        if not available:
+            self._refilled.wait(self.max_wait)
+        with self._lock:
+            if not self.proxies:
+                logger.info("No proxy available, sending the request directly")
+                return None
+            addresses = list(self.proxies)
+            return random.choices(addresses, weights=self._weights(addresses))[0]
+
+    def report(self, address, ok, latency=None):
+        if not address:
+            return
+        with self._lock:
+            proxy = self.proxies.get(address)
+            if not proxy:
+                return
+            if ok:
+                proxy["successes"] += 1
+                proxy["failures"] = 0
+                proxy["score"] = min(1.0, proxy["score"] + 0.1)
+                if latency is not None:
+                    proxy["latency"] = latency if proxy["latency"] is None else proxy["latency"] * 0.8 + latency * 0.2
+                return
+            proxy["failures"] += 1
+            proxy["score"] *= 0.5
+            if proxy["failures"] >= self.max_failures:
+                del self.proxies[address]
+                self.banned.add(address)
+                logger.info(f"Proxy {address} banned after {proxy['failures']} consecutive failures")
+
+    def stats(self):
+        """Proxy pool gauges exported with the metrics."""
+        with self._lock:
+            return {"proxies_available": len(self.proxies), "proxies_banned": len(self.banned)}
+
+    @staticmethod
+    def as_requests_proxies(address):
+        if not address:
+            return {}
+        return {'http': 'http://' + address, 'https': 'http://' + address}
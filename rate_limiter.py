@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import threading
+import time
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+OK = 'ok'
+THROTTLED = 'throttled'
+ERROR = 'error'
+
+THROTTLE_STATUS_CODES = {429, 503}
+
+def classify_status(status_code):
+    if status_code in THROTTLE_STATUS_CODES:
+        return THROTTLED
+    if status_code >= 400:
+        return ERROR
+    return OK
+
+def host_of(url):
+    return urlparse(url).netloc.lower()
+
+class AIMDLimit:
+    """单个 host 的并发上限，加性增加、乘性减少（AIMD）。
+
+    请求健康（延迟没有明显高于基线、错误率低）时每次成功把上限加 increase/limit，
+    大约每一轮窗口加 increase；遇到 429/503/超时或错误率过高时上限减半，
+    cooldown 秒内只减一次，避免同一波失败把上限连续砍到底。
+    """
+
+    def __init__(self, initial=4, min_limit=1, max_limit=64, increase=1.0, decrease=0.5,
+                 latency_factor=2.0, max_error_rate=0.1, cooldown=2.0):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.max_error_rate = max_error_rate
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.baseline_latency = None
+        self.avg_latency = None
+        self.error_rate = 0.0
+        self._last_decrease = 0.0
+
+    @property
+    def current(self):
+        return max(self.min_limit, int(self.limit))
+
+    def has_capacity(self):
+        return self.in_flight < self.current
+
+    def record(self, latency, outcome):
+        self.error_rate = self.error_rate * 0.9 + (0.1 if outcome != OK else 0.0)
+        if outcome == THROTTLED or self.error_rate > self.max_error_rate:
+            self._back_off()
+            return
+
+        if outcome == OK:
+            self.avg_latency = latency if self.avg_latency is None else self.avg_latency * 0.8 + latency * 0.2
+            if self.baseline_latency is None or self.avg_latency < self.baseline_latency:
+                self.baseline_latency = self.avg_latency
+            if self.avg_latency <= self.baseline_latency * self.latency_factor:
+                self.limit = min(self.max_limit, self.limit + self.increase / self.limit)
+
+    def _back_off(self):
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * self.decrease)
+        # 延迟基线随之重置，避免一直用拥塞前的低延迟作比较
+        self.baseline_latency = self.avg_latency
+
+def _limit_stats(limits):
+    return {
+        "host_concurrency_limit": {host: limit.current for host, limit in limits.items()},
+        "host_in_flight": {host: limit.in_flight for host, limit in limits.items()},
+    }
+
+class RateLimiter:
+    """按 host 区分的自适应限流器，供线程版 Crawler 使用。"""
+
+    def __init__(self, **limit_options):
+        self.limit_options = limit_options
+        self.limits = {}
+        self._condition = threading.Condition()
+
+    def _limit_for(self, host):
+        if host not in self.limits:
+            self.limits[host] = AIMDLimit(**self.limit_options)
+        return self.limits[host]
+
+    def acquire(self, url):
+        host = host_of(url)
+        with self._condition:
+            limit = self._limit_for(host)
+            while not limit.has_capacity():
+                self._condition.wait()
+            limit.in_flight += 1
+        return host, time.monotonic()
+
+    def release(self, token, outcome):
+        host, started = token
+        with self._condition:
+            limit = self.limits[host]
+            limit.in_flight -= 1
+            previous = limit.current
+            limit.record(time.monotonic() - started, outcome)
+            if limit.current != previous:
+                logger.info(f"Concurrency for {host} changed from {previous} to {limit.current}")
+            self._condition.notify_all()
+
+    def stats(self):
+        """Per-host gauges for the metrics collector: current concurrency limit and requests in flight."""
+        with self._condition:
+            return _limit_stats(self.limits)
+
+class AsyncRateLimiter(RateLimiter):
+    """RateLimiter 的 asyncio 版本，必须在同一个事件循环中使用。"""
+
+    def __init__(self, **limit_options):
+        super().__init__(**limit_options)
+        self._condition = None
+
+    async def acquire(self, url):
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        host = host_of(url)
+        async with self._condition:
+            limit = self._limit_for(host)
+            await self._condition.wait_for(limit.has_capacity)
+            limit.in_flight += 1
+        return host, time.monotonic()
+
+    async def release(self, token, outcome):
+        host, started = token
+        async with self._condition:
+            limit = self.limits[host]
+            limit.in_flight -= 1
+            previous = limit.current
+            limit.record(time.monotonic() - started, outcome)
+            if limit.current != previous:
+                logger.info(f"Concurrency for {host} changed from {previous} to {limit.current}")
+            self._condition.notify_all()
+
+    def stats(self):
+        # 由其他线程读取；复制一份再遍历，避免事件循环同时新增 host
+        return _limit_stats(dict(self.limits))
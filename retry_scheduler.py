@@ -0,0 +1,151 @@
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class RetryBudget:
+    """整个抓取过程共用的重试预算。
+
+    重试总次数不超过 minimum + ratio × 请求数。站点整体出问题时，失败的请求不会各自重试
+    max_retries 次、把请求量放大数倍，预算用完后失败直接返回。
+    """
+
+    def __init__(self, ratio=0.2, minimum=100):
+        self.ratio = ratio
+        self.minimum = minimum
+        self.requests = 0
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def record_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def spend(self):
+        """Take one retry from the budget; False when it is used up."""
+        with self._lock:
+            if self.retries >= self.minimum + self.ratio * self.requests:
+                return False
+            self.retries += 1
+            return True
+
+class RetryScheduler:
+    """失败的章节和图片放入延迟队列，退避时间到了再重新交给工作线程。
+
+    等待退避期间不占用工作线程，线程可以继续处理其他 URL。退避时间为
+    [0, min(max_delay, base_delay × 2^attempt)] 内的随机值（full jitter），同一时刻失败的请求
+    不会在同一时刻一起重试。每个 key 最多延迟重试 max_attempts 次，每次重试消耗 budget；
+    次数或预算用完的章节留到最后，所有工作完成后由 final_pass 统一再试一次。
+    目录页不经过这里：下一页要等这一页抓到才知道，仍由 crawler 在抓取目录的线程中退避重试。
+    """
+
+    def __init__(self, budget=None, max_attempts=3, base_delay=1.0, max_delay=60.0, metrics=None):
+        self.budget = budget if budget else RetryBudget()
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.metrics = metrics
+        self.attempts = {}
+        self.parked = []
+        self.final = False
+        self._heap = []
+        self._sequence = itertools.count()
+        self._delivering = 0
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def _incr(self, name):
+        if self.metrics:
+            self.metrics.incr(name)
+
+    def _push(self, delay, resubmit):
+        heapq.heappush(self._heap, (time.monotonic() + delay, next(self._sequence), resubmit))
+        self._condition.notify_all()
+
+    def defer(self, key, resubmit, park=True):
+        """Call resubmit() from the scheduler thread after a jittered backoff.
+
+        Returns False when key should be given up on: its attempts or the budget are used up
+        (unless park is true, in which case it waits for final_pass), or the final pass has started.
+        """
+        with self._condition:
+            if self.final or self._closed:
+                return False
+            attempt = self.attempts.get(key, 0)
+            if attempt < self.max_attempts and self.budget.spend():
+                self.attempts[key] = attempt + 1
+                delay = self.backoff(attempt)
+                self._push(delay, resubmit)
+                self._incr('retries_deferred')
+                logger.info(f"Retrying {key} in {delay:.1f}s ({attempt + 1}/{self.max_attempts})")
+                return True
+            if park:
+                self.parked.append(resubmit)
+                self._incr('retries_parked')
+                return True
+            self._incr('retries_exhausted')
+            return False
+
+    def final_pass(self):
+        """Resubmit every parked item once more; later failures are not retried. Returns the number resubmitted."""
+        with self._condition:
+            self.final = True
+            parked, self.parked = self.parked, []
+            for resubmit in parked:
+                # 打散最后一轮的请求，不在同一时刻一起发出
+                self._push(random.uniform(0, self.base_delay), resubmit)
+        if parked:
+            logger.info(f"Final retry pass over {len(parked)} failed items")
+        return len(parked)
+
+    @property
+    def pending(self):
+        """Number of items waiting for their backoff or being resubmitted."""
+        with self._condition:
+            return len(self._heap) + self._delivering
+
+    def wait_idle(self):
+        """Block until every deferred item has been resubmitted."""
+        with self._condition:
+            while self._heap or self._delivering:
+                self._condition.wait()
+
+    def _run(self):
+        with self._condition:
+            while not self._closed:
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+                due, _, resubmit = self._heap[0]
+                delay = due - time.monotonic()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+                # resubmit 可能阻塞（队列已满），期间仍计入 pending，wait_idle 不会提前返回
+                self._delivering += 1
+                self._condition.release()
+                try:
+                    resubmit()
+                except Exception as e:
+                    logger.error(f"Failed to resubmit a deferred retry. Error: {e}")
+                finally:
+                    self._condition.acquire()
+                    self._delivering -= 1
+                    self._condition.notify_all()
+
+    def close(self):
+        """Stop the scheduler thread; items still waiting for their backoff are dropped."""
+        # 抓取异常中断时 resubmit 可能阻塞在已经没有消费者的队列上，因此不 join 守护线程
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
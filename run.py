@@ -1,15 +1,23 @@
-import inquirer
-import validators
 import re
 from crawler import Crawler
+from http_cache import HttpCache
+from crawl_state import CrawlState
+from image_manifest import ImageManifest
+from pack_store import PackStore
+from retry_scheduler import RetryScheduler
+from article_processor import ArticleProcessor, markup_report
 from article_manager import ArticleManager, TOCManager, ArticleDownloader, Utility, ImageHandler
-from epub_generator import EpubGenerator
+from epub_generator import EpubGenerator, split_volumes
+from metrics import ProgressReporter
+import logging
 import os
 import subprocess
 import time
 from multiprocessing import Process
 
+# inquirer、validators、aiohttp 和 Pillow 只在用到时才导入，batch.py 等入口不需要为它们付出启动时间
 def get_input(message, default=None, validate=None):
+    import inquirer
     if validate:
         questions = [inquirer.Text('input', message=message, default=default, validate=validate)]
     else:
@@ -23,6 +31,7 @@ def ensure_url_scheme(url):
     return url
 
 def validate_url(answers, url):
+    import validators
     if validators.url(url) or validators.url('http://' + url) or re.match(r'http://localhost:\d+', url):
         return True
     return False
@@ -59,7 +68,119 @@ def run_proxy_pool():
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
 
+def assemble_epub(toc, image_manifest, cover_path, book_name, language='zh', author=None, identifier=None, epub_name=None,
+                  work_dir='tmp', output_dir='book', volume_chapters=None, volume_mb=None, store=None):
+    """Write the EPUB from the chapters in store (or work_dir) and the images in work_dir.
+
+    With volume_chapters or volume_mb the book is split into volumes that are built in
+    parallel, and a list of paths is returned instead of a single path.
+    """
+    epub_generator = EpubGenerator(base_dir=work_dir, output_dir=output_dir, store=store)
+    if volume_chapters or volume_mb:
+        volumes = split_volumes(toc, work_dir, volume_chapters, volume_mb * 1024 * 1024 if volume_mb else None, image_manifest.chapters, store)
+        if len(volumes) > 1:
+            return epub_generator.generate_volumes(volumes, book_name, author or book_name, language, epub_name or book_name, cover_path, identifier,
+                                                   streaming=max(len(volume) for volume in volumes) > 1000,
+                                                   image_files=[image_manifest.images_for(entry['filename'] for entry in volume) for volume in volumes])
+    return epub_generator.generate_epub(toc_list = toc, book_name = book_name, author = author or book_name, language = language,epub_name=epub_name or book_name, cover_path=cover_path, identifier=identifier, streaming=len(toc) > 1000, image_files=image_manifest.images_for(entry['filename'] for entry in toc))
+
+def build_book(crawler, target_url, article_link_selector, next_page_selector, article_selector, remove_selectors,
+               book_name, language='zh', pipelined=True, optimize_images="n", timings=None,
+               progress=True, metrics_path='metrics.json', author=None, identifier=None, epub_name=None,
+               work_dir='tmp', output_dir='book', processor=None, dedupe_content=False, volume_chapters=None,
+               volume_mb=None, pack_chapters=True, defer_retries=True):
+    """Crawl the TOC and chapters with the given crawler and build the EPUB.
+
+    Intermediate files go to work_dir, so several books can be built in one process as long
+    as each has its own work_dir. Stage durations in seconds are recorded into timings when
+    a dict is passed. The crawler's metrics are exported to metrics_path (relative to
+    work_dir; Prometheus text for a .prom file, JSON otherwise). A shared processor is used
+    as-is, otherwise one is created for this book. With dedupe_content, chapters whose text
+    matches an earlier chapter are left out. volume_chapters / volume_mb split the book into
+    volumes (see assemble_epub). Chapters are stored in one pack file (work_dir/chapters.pack)
+    unless pack_chapters is false, in which case each chapter is its own file. With defer_retries,
+    failed chapters and images go through a RetryScheduler that shares the crawler's retry budget
+    instead of retrying in the worker threads. Returns the TOC and the path of the generated EPUB, or a list
+    of paths when the book was split.
+    """
+    timings = {} if timings is None else timings
+    metrics = crawler.metrics
+    reporter = ProgressReporter(metrics).start() if progress else None
+    utility = Utility()
+    os.makedirs(work_dir, exist_ok=True)
+    # 记录抓取进度，中断后重新运行只会继续未完成的章节和图片
+    state = CrawlState(os.path.join(work_dir, 'crawl_state.db'))
+    previous = state.summary()
+    if previous:
+        print(f"Resuming {work_dir}: {previous.get('done', 0)} chapters done, {previous.get('failed', 0)} failed in earlier runs")
+    # 失败的章节和图片放入延迟队列重试，工作线程不会停在退避等待上
+    retry_scheduler = RetryScheduler(crawler.retry_budget, metrics=metrics) if defer_retries else None
+    image_handler = ImageHandler(crawler, utility, state=state, base_dir=work_dir, retry_scheduler=retry_scheduler)
+    toc_manager = TOCManager(crawler, utility, state=state, base_dir=work_dir)
+    image_manifest = ImageManifest(os.path.join(work_dir, 'images.yaml'))
+    # 章节追加写入同一个压缩打包文件，避免成千上万个小文件
+    store = PackStore(os.path.join(work_dir, 'chapters.pack')) if pack_chapters else None
+    # 解析和清理在进程池中进行，随 CPU 核数扩展
+    own_processor = processor is None
+    if own_processor:
+        processor = ArticleProcessor()
+    article_downloader = ArticleDownloader(crawler, utility, image_handler, state=state, image_manifest=image_manifest, processor=processor,
+                                           dedupe_content=dedupe_content, store=store, retry_scheduler=retry_scheduler)
+    article_manager = ArticleManager(toc_manager, article_downloader)
+
+    try:
+        started = time.perf_counter()
+        if pipelined:
+            toc = article_manager.download_pipelined(target_url, article_link_selector, next_page_selector, article_selector, remove_selectors, base_dir=work_dir)
+            timings['crawl'] = time.perf_counter() - started
+        else:
+            toc = article_manager.generate_and_save_toc(target_url, article_link_selector, next_page_selector, base_dir=work_dir)
+            timings['toc'] = time.perf_counter() - started
+            started = time.perf_counter()
+            article_manager.download_articles(toc, article_selector, remove_selectors, base_dir=work_dir)
+            timings['articles'] = time.perf_counter() - started
+    finally:
+        if reporter:
+            reporter.stop()
+        if own_processor:
+            processor.shutdown()
+        image_handler.scheduler.shutdown()
+        if retry_scheduler:
+            retry_scheduler.close()
+        state.close()
+
+    report = markup_report(metrics.snapshot()["counters"])
+    if report:
+        print(report)
+
+    if optimize_images != "n":
+        from image_optimizer import ImageOptimizer
+        started = time.perf_counter()
+        optimizer = ImageOptimizer(grayscale=optimize_images == "gray")
+        with metrics.timer('optimize'):
+            stats = optimizer.optimize(image_handler.scheduler.saved_paths)
+        print(f"Image optimization saved {stats['bytes_saved'] / 1024 / 1024:.2f} MB "
+              f"({stats['bytes_before']} -> {stats['bytes_after']} bytes, {stats['images']} images)")
+        timings['optimize'] = time.perf_counter() - started
+
+    toc = [entry for entry in toc if entry['filename'] not in article_downloader.duplicate_files]
+    started = time.perf_counter()
+    try:
+        with metrics.timer('epub'):
+            cover_path = image_handler.generate_book_cover(book_name)
+            epub_path = assemble_epub(toc, image_manifest, cover_path, book_name, language, author, identifier, epub_name, work_dir, output_dir,
+                                      volume_chapters, volume_mb, store)
+    finally:
+        if store is not None:
+            store.close()
+    timings['epub'] = time.perf_counter() - started
+    if metrics_path:
+        metrics.export(os.path.join(work_dir, metrics_path))
+    return toc, epub_path
+
 if __name__ == "__main__":
+    # 日志级别只在入口处设置一次，进度由 ProgressReporter 输出
+    logging.basicConfig(level=logging.WARNING)
     utility = Utility()
     target_url = get_input("Enter the URL of the website to be crawled",default=None, validate=validate_url)
     second_level_domain = utility.extract_second_level_domain(target_url)
@@ -76,14 +197,24 @@ if __name__ == "__main__":
     else:
         metadata = {'book_language':'zh'}
     
-    crawler = Crawler(proxy_pool_url)
-    image_handler = ImageHandler(crawler, utility)
-    toc_manager = TOCManager(crawler, utility)
-    article_downloader = ArticleDownloader(crawler, utility, image_handler)
-    article_manager = ArticleManager(toc_manager, article_downloader)
-    
-    toc = article_manager.generate_and_save_toc(target_url, article_link_selector, next_page_selector)
-    article_manager.download_articles(toc, article_selector, remove_selectors)
-    epub_generator = EpubGenerator(base_dir='tmp/',output_dir='book/')
-    image_handler.generate_book_cover(second_level_domain)
-    epub_generator.generate_epub(toc_list = toc, book_name = second_level_domain, author = second_level_domain, language = metadata['book_language'],epub_name=second_level_domain, cover_path="tmp/cover.jpg")
\ No newline at end of file
+    engine = get_input("Choose the fetch engine (threads/async)", default="threads")
+    # 重复抓取时大部分页面只需要 304 重新验证
+    cache = HttpCache('cache')
+    if engine == "async":
+        from async_crawler import AsyncCrawler
+        concurrency = int(get_input("Enter the maximum number of concurrent requests", default="200"))
+        crawler = AsyncCrawler(proxy_pool_url, concurrency=concurrency, cache=cache)
+    else:
+        crawler = Crawler(proxy_pool_url, cache=cache)
+    pipelined = get_input("Start downloading chapters while the TOC is still being crawled? (y/n)", default="y")
+    optimize_images = get_input("Optimize images for e-readers? (n/y/gray)", default="n")
+    dedupe_content = get_input("Skip chapters with the same text as an earlier chapter? (y/n)", default="n")
+    volume_chapters = int(get_input("Split the book into volumes of how many chapters? (0 for a single file)", default="0"))
+    build_book(crawler, target_url, article_link_selector, next_page_selector, article_selector, remove_selectors,
+               book_name=metadata.get('book_title') or second_level_domain, language=metadata['book_language'],
+               author=metadata.get('book_author'), identifier=metadata.get('book_identifier'),
+               epub_name=metadata.get('output_filename'), pipelined=pipelined == "y", optimize_images=optimize_images,
+               dedupe_content=dedupe_content == "y", volume_chapters=volume_chapters or None)
+    crawler.print_failed_requests()
+    if crawler.is_async:
+        crawler.close()
@@ -0,0 +1,141 @@
+import logging
+import zipfile
+from datetime import datetime, timezone
+from xml.sax.saxutils import escape, quoteattr
+from lxml import etree, html
+
+logger = logging.getLogger(__name__)
+
+CONTAINER_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="EPUB/content.opf" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>
+"""
+
+XHTML_TEMPLATE = """<?xml version='1.0' encoding='utf-8'?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" lang={lang} xml:lang={lang}>
+<head><title>{title}</title></head>
+<body>{body}</body>
+</html>
+"""
+
+def to_xhtml_fragment(content):
+    """Convert an HTML fragment into well-formed XHTML markup."""
+    if not content or not content.strip():
+        return ''
+    fragment = html.fragment_fromstring(content, create_parent='div')
+    # 外层 div 只是解析时加的容器，输出时去掉
+    parts = [escape(fragment.text or '')]
+    parts += [etree.tostring(child, method='xml', encoding='unicode') for child in fragment]
+    return ''.join(parts)
+
+def series_metadata(series):
+    """OPF <meta> (attributes, text) pairs marking a volume as part of a series, given (name, index)."""
+    if not series:
+        return []
+    name, index = series
+    return [
+        ({"property": "belongs-to-collection", "id": "series"}, name),
+        ({"refines": "#series", "property": "collection-type"}, "series"),
+        ({"refines": "#series", "property": "group-position"}, str(index)),
+        # 旧版阅读器和 Calibre 只认这两个字段
+        ({"name": "calibre:series", "content": name}, ''),
+        ({"name": "calibre:series_index", "content": str(index)}, ''),
+    ]
+
+class StreamingEpubWriter:
+    """逐条写入 EPUB 的 zip 文件，内存占用与书的大小无关。
+
+    章节和图片在 add_* 时立即写入 zip，只在内存中保留清单所需的元数据（id、文件名、标题、类型），
+    OPF、NCX 和 nav 在 close 时根据这些元数据生成。
+    """
+
+    def __init__(self, epub_path, identifier, title, language, author, series=None):
+        self.identifier = identifier
+        self.title = title
+        self.language = language
+        self.author = author
+        self.series = series
+        self.manifest = []
+        self.spine = []
+        self.toc = []
+        self.cover_id = None
+        self.zip = zipfile.ZipFile(epub_path, 'w', compression=zipfile.ZIP_DEFLATED)
+        # mimetype 必须是第一个条目且不压缩
+        self.zip.writestr(zipfile.ZipInfo('mimetype'), 'application/epub+zip', compress_type=zipfile.ZIP_STORED)
+        self.zip.writestr('META-INF/container.xml', CONTAINER_XML)
+
+    def _page(self, title, body):
+        return XHTML_TEMPLATE.format(lang=quoteattr(self.language), title=escape(title), body=body)
+
+    def set_cover(self, file_name, cover_path, media_type='image/jpeg'):
+        self.zip.write(cover_path, f'EPUB/{file_name}')
+        self.cover_id = 'cover-img'
+        self.manifest.append({"id": self.cover_id, "href": file_name, "media_type": media_type, "properties": "cover-image"})
+        body = f'<img src={quoteattr(file_name)} alt="Cover"/>'
+        self.zip.writestr('EPUB/cover.xhtml', self._page('Cover', body))
+        self.manifest.append({"id": 'cover', "href": 'cover.xhtml', "media_type": 'application/xhtml+xml'})
+        self.spine.append('cover')
+
+    def add_chapter(self, title, file_name, content):
+        item_id = f'chapter_{len(self.toc)}'
+        self.zip.writestr(f'EPUB/{file_name}', self._page(title, to_xhtml_fragment(content)))
+        self.manifest.append({"id": item_id, "href": file_name, "media_type": 'application/xhtml+xml'})
+        self.spine.append(item_id)
+        self.toc.append({"id": item_id, "href": file_name, "title": title})
+
+    def add_image(self, file_name, image_path, media_type):
+        self.zip.write(image_path, f'EPUB/{file_name}')
+        self.manifest.append({"id": f'image_{len(self.manifest)}', "href": file_name, "media_type": media_type})
+
+    def _nav(self):
+        items = ''.join(f'<li><a href={quoteattr(entry["href"])}>{escape(entry["title"])}</a></li>' for entry in self.toc)
+        body = f'<nav epub:type="toc" id="id" role="doc-toc"><h2>{escape(self.title)}</h2><ol>{items}</ol></nav>'
+        return self._page(self.title, body)
+
+    def _ncx(self):
+        points = ''.join(
+            f'<navPoint id={quoteattr(entry["id"])}><navLabel><text>{escape(entry["title"])}</text></navLabel>'
+            f'<content src={quoteattr(entry["href"])}/></navPoint>'
+            for entry in self.toc)
+        return ('<?xml version=\'1.0\' encoding=\'utf-8\'?>\n'
+                '<ncx xmlns="http://www.daisy.org/z3986/2005/ncx/" version="2005-1">'
+                f'<head><meta name="dtb:uid" content={quoteattr(self.identifier)}/>'
+                '<meta name="dtb:depth" content="1"/><meta name="dtb:totalPageCount" content="0"/>'
+                '<meta name="dtb:maxPageNumber" content="0"/></head>'
+                f'<docTitle><text>{escape(self.title)}</text></docTitle>'
+                f'<navMap>{points}</navMap></ncx>')
+
+    def _opf(self):
+        modified = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        items = ''.join(
+            f'<item href={quoteattr(item["href"])} id={quoteattr(item["id"])} media-type={quoteattr(item["media_type"])}'
+            + (f' properties={quoteattr(item["properties"])}' if item.get("properties") else '') + '/>'
+            for item in self.manifest)
+        itemrefs = ''.join(f'<itemref idref={quoteattr(item_id)}/>' for item_id in ['nav'] + self.spine)
+        cover_meta = f'<meta name="cover" content={quoteattr(self.cover_id)}/>' if self.cover_id else ''
+        series_meta = ''.join(
+            '<meta ' + ' '.join(f'{key}={quoteattr(value)}' for key, value in attributes.items())
+            + (f'>{escape(text)}</meta>' if text else '/>')
+            for attributes, text in series_metadata(self.series))
+        return ('<?xml version=\'1.0\' encoding=\'utf-8\'?>\n'
+                '<package xmlns="http://www.idpf.org/2007/opf" unique-identifier="id" version="3.0">'
+                '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">'
+                f'<dc:identifier id="id">{escape(self.identifier)}</dc:identifier>'
+                f'<dc:title>{escape(self.title)}</dc:title>'
+                f'<dc:language>{escape(self.language)}</dc:language>'
+                f'<dc:creator id="creator">{escape(self.author)}</dc:creator>'
+                f'<meta property="dcterms:modified">{modified}</meta>{cover_meta}{series_meta}</metadata>'
+                f'<manifest>{items}'
+                '<item href="nav.xhtml" id="nav" media-type="application/xhtml+xml" properties="nav"/>'
+                '<item href="toc.ncx" id="ncx" media-type="application/x-dtbncx+xml"/></manifest>'
+                f'<spine toc="ncx">{itemrefs}</spine></package>')
+
+    def close(self):
+        self.zip.writestr('EPUB/nav.xhtml', self._nav())
+        self.zip.writestr('EPUB/toc.ncx', self._ncx())
+        self.zip.writestr('EPUB/content.opf', self._opf())
+        self.zip.close()
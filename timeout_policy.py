@@ -0,0 +1,91 @@
+import threading
+import time
+from collections import deque
+from rate_limiter import host_of
+
+def remaining(deadline):
+    """Seconds left until a time.monotonic() deadline, or None when there is no deadline."""
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.monotonic())
+
+class HostTimeouts:
+    def __init__(self, window):
+        self.samples = deque(maxlen=window)
+        self.penalty = 1.0
+        self.cached = None
+
+class TimeoutPolicy:
+    """按 host 的历史耗时自动确定连接/读取超时，取代超时后的人工输入。
+
+    样本数达到 min_samples 之前使用 default；之后连接超时取 p95 的 multiplier / 2 倍，
+    读取超时取 p99 的 multiplier 倍，并限制在 [min_timeout, max_timeout] 之间。
+    每次超时把该 host 的超时放大 backoff 倍，成功后逐步恢复。
+    """
+
+    def __init__(self, default=(5, 10), min_timeout=(1, 2), max_timeout=(15, 60), multiplier=4,
+                 min_samples=10, window=200, backoff=1.5):
+        self.default = default
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.multiplier = multiplier
+        self.min_samples = min_samples
+        self.window = window
+        self.backoff = backoff
+        self.hosts = {}
+        self._lock = threading.Lock()
+
+    def _host(self, url):
+        host = host_of(url)
+        state = self.hosts.get(host)
+        if state is None:
+            state = self.hosts[host] = HostTimeouts(self.window)
+        return state
+
+    def _percentile(self, ordered, q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def _compute(self, state):
+        if len(state.samples) < self.min_samples:
+            connect, read = self.default
+        else:
+            ordered = sorted(state.samples)
+            connect = self._percentile(ordered, 0.95) * self.multiplier / 2
+            read = self._percentile(ordered, 0.99) * self.multiplier
+        return tuple(min(upper, max(lower, value * state.penalty))
+                     for value, lower, upper in zip((connect, read), self.min_timeout, self.max_timeout))
+
+    def timeout(self, url, deadline=None):
+        """Return (connect, read) timeouts for url, shortened to fit the deadline if one is given."""
+        with self._lock:
+            state = self._host(url)
+            if state.cached is None:
+                state.cached = self._compute(state)
+            timeouts = state.cached
+        left = remaining(deadline)
+        if left is not None:
+            timeouts = tuple(min(value, left) for value in timeouts)
+        return timeouts
+
+    def observe(self, url, seconds):
+        with self._lock:
+            state = self._host(url)
+            state.samples.append(seconds)
+            state.penalty = max(1.0, state.penalty * 0.9)
+            state.cached = None
+
+    def timed_out(self, url):
+        with self._lock:
+            state = self._host(url)
+            state.penalty = min(state.penalty * self.backoff, max(self.max_timeout) / min(self.min_timeout))
+            state.cached = None
+
+    def stats(self):
+        """Per-host gauges for the metrics collector: current connect/read timeouts and the timeout penalty."""
+        with self._lock:
+            timeouts = {host: state.cached or self._compute(state) for host, state in self.hosts.items()}
+            return {
+                "host_connect_timeout_seconds": {host: connect for host, (connect, read) in timeouts.items()},
+                "host_read_timeout_seconds": {host: read for host, (connect, read) in timeouts.items()},
+                "host_timeout_penalty": {host: state.penalty for host, state in self.hosts.items()},
+            }
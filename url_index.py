@@ -0,0 +1,116 @@
+import hashlib
+import math
+import re
+import threading
+from urllib.parse import urlsplit, urlunsplit
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+# 只影响统计、不影响页面内容的查询参数
+TRACKING_PARAMS = re.compile(r'^(utm_\w+|spm|fbclid|gclid)$', re.IGNORECASE)
+PERCENT_ESCAPE = re.compile(r'%[0-9a-fA-F]{2}')
+IMG_SRC_PATTERN = re.compile(r'<img\b[^>]*?\bsrc\s*=\s*["\']?([^"\'\s>]+)', re.IGNORECASE)
+
+def _query_key(segment):
+    return segment.split('=', 1)[0]
+
+def canonicalize_url(url):
+    """Return a canonical form of url so that links to the same chapter compare equal.
+
+    The result is only a dedupe key; the original URL is still the one that is fetched.
+    The scheme and host are lowercased, default ports, fragments and tracking parameters are
+    dropped and an empty path becomes '/'. Query parameters are never decoded (sites use GBK
+    and other encodings): the raw `key=value` segments are sorted by key, keeping the order of
+    repeated keys, and only the case of percent escapes is normalized.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    if parts.username:
+        host = f"{parts.username}{':' + parts.password if parts.password else ''}@{host}"
+    segments = [segment for segment in PERCENT_ESCAPE.sub(lambda m: m.group(0).upper(), parts.query).split('&')
+                if segment and not TRACKING_PARAMS.match(_query_key(segment))]
+    return urlunsplit((scheme, host, parts.path or '/', '&'.join(sorted(segments, key=_query_key)), ''))
+
+def content_fingerprint(html):
+    """Fingerprint of the visible text and image sources of an article, ignoring other markup and whitespace.
+
+    Image sources are saved filenames named after the image content, so image-only chapters
+    (comic pages, illustrations) only match when they show the same images. Returns None for
+    a chapter with neither text nor images, which is never treated as a duplicate.
+    """
+    text = re.sub(r'\s+', '', re.sub(r'<[^>]*>', '', html))
+    images = IMG_SRC_PATTERN.findall(html)
+    if not text and not images:
+        return None
+    return hashlib.sha1('\0'.join([text] + images).encode('utf-8')).digest()
+
+class BloomFilter:
+    """定长位数组的布隆过滤器，capacity 个元素时误判率约为 error_rate，只会误报不会漏报。"""
+
+    def __init__(self, capacity, error_rate=1e-6):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8') if isinstance(key, str) else key, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key):
+        """Add key and return True if it was (probably) not present before."""
+        new = False
+        for position in self._positions(key):
+            byte, bit = divmod(position, 8)
+            if not self.bits[byte] & (1 << bit):
+                self.bits[byte] |= 1 << bit
+                new = True
+        return new
+
+    def __contains__(self, key):
+        return all(self.bits[position // 8] & (1 << (position % 8)) for position in self._positions(key))
+
+class SeenIndex:
+    """线程安全的去重集合。
+
+    元素数量不超过 max_exact 时用普通 set 精确去重；超过后转存到容量为 bloom_capacity 的布隆过滤器，
+    内存占用固定，代价是约 error_rate 的概率把新元素误判为重复。
+    """
+
+    def __init__(self, max_exact=200_000, bloom_capacity=10_000_000, error_rate=1e-6):
+        self.max_exact = max_exact
+        self.bloom_capacity = bloom_capacity
+        self.error_rate = error_rate
+        self.exact = set()
+        self.bloom = None
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def add(self, key):
+        """Record key and return True if it had not been seen before."""
+        with self._lock:
+            if self.bloom is not None:
+                new = self.bloom.add(key)
+            elif key in self.exact:
+                new = False
+            else:
+                self.exact.add(key)
+                new = True
+                if len(self.exact) > self.max_exact:
+                    self.bloom = BloomFilter(max(self.bloom_capacity, len(self.exact) * 2), self.error_rate)
+                    for seen in self.exact:
+                        self.bloom.add(seen)
+                    self.exact = set()
+            self.count += new
+            return new
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self.bloom if self.bloom is not None else key in self.exact
+
+    def __len__(self):
+        return self.count
@@ -0,0 +1,238 @@
+import json
+import threading
+import time
+from collections import deque
+
+class MemoryWorkQueue:
+    """进程内的章节工作队列，接口与 RedisWorkQueue 一致，用于测试和单机运行。
+
+    coordinator 用 publish 发布 TOC 条目，worker 用 claim 领取章节并获得 lease_seconds 的租约，
+    完成后 complete 上报结果和图片，失败时 fail。租约过期的章节会被重新放回队列，
+    领取次数超过 max_attempts 后记为失败。
+    """
+
+    def __init__(self, job='default', lease_seconds=180, max_attempts=3):
+        self.job = job
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._config = None
+        self._pending = deque()
+        self._entries = {}
+        self._leases = {}
+        self._attempts = {}
+        self._results = {}
+        self._failed = {}
+        self._images = {}
+        self._toc_closed = False
+        self._lock = threading.Lock()
+
+    def reset(self):
+        """Forget every chapter, result and image of this job."""
+        self.__init__(self.job, self.lease_seconds, self.max_attempts)
+
+    def set_config(self, config):
+        """Store the job settings the workers need; this also reopens the TOC for publishing."""
+        with self._lock:
+            self._config = dict(config)
+            self._toc_closed = False
+
+    def get_config(self):
+        with self._lock:
+            return dict(self._config) if self._config is not None else None
+
+    def publish(self, entries):
+        with self._lock:
+            for entry in entries:
+                if entry['url'] in self._entries:
+                    continue
+                self._entries[entry['url']] = dict(entry)
+                self._pending.append(entry['url'])
+
+    def close_toc(self):
+        with self._lock:
+            self._toc_closed = True
+
+    def _requeue_or_fail(self, url, error):
+        if self._attempts.get(url, 0) >= self.max_attempts:
+            self._failed[url] = str(error)
+        else:
+            self._pending.append(url)
+
+    def claim(self, worker_id):
+        """Lease the next chapter to worker_id and return its TOC entry, or None if nothing is pending."""
+        now = time.time()
+        with self._lock:
+            for url, (_, expires) in list(self._leases.items()):
+                if expires <= now:
+                    del self._leases[url]
+                    self._requeue_or_fail(url, "lease expired")
+            if not self._pending:
+                return None
+            url = self._pending.popleft()
+            self._leases[url] = (worker_id, now + self.lease_seconds)
+            self._attempts[url] = self._attempts.get(url, 0) + 1
+            return dict(self._entries[url])
+
+    def complete(self, url, result, images=None):
+        with self._lock:
+            self._leases.pop(url, None)
+            self._failed.pop(url, None)
+            self._results[url] = result
+            for name, data in (images or {}).items():
+                self._images.setdefault(name, data)
+
+    def fail(self, url, error):
+        with self._lock:
+            if self._leases.pop(url, None) is not None:
+                self._requeue_or_fail(url, error)
+
+    def finished(self):
+        with self._lock:
+            return self._toc_closed and not self._pending and not self._leases
+
+    def status(self):
+        with self._lock:
+            return {"pending": len(self._pending), "leased": len(self._leases),
+                    "done": len(self._results), "failed": len(self._failed)}
+
+    def result(self, url):
+        with self._lock:
+            return self._results.get(url)
+
+    def failures(self):
+        with self._lock:
+            return dict(self._failed)
+
+    def image(self, name):
+        with self._lock:
+            return self._images.get(name)
+
+CLAIM_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now)
+for _, url in ipairs(expired) do
+    redis.call('ZREM', KEYS[2], url)
+    if tonumber(redis.call('HGET', KEYS[3], url) or '0') >= tonumber(ARGV[3]) then
+        redis.call('HSET', KEYS[4], url, 'lease expired')
+    else
+        redis.call('RPUSH', KEYS[1], url)
+    end
+end
+local url = redis.call('LPOP', KEYS[1])
+if not url then
+    return false
+end
+redis.call('ZADD', KEYS[2], now + tonumber(ARGV[1]), url)
+redis.call('HINCRBY', KEYS[3], url, 1)
+return url
+"""
+
+FAIL_SCRIPT = """
+if redis.call('ZREM', KEYS[2], ARGV[1]) == 0 then
+    return 0
+end
+if tonumber(redis.call('HGET', KEYS[3], ARGV[1]) or '0') >= tonumber(ARGV[3]) then
+    redis.call('HSET', KEYS[4], ARGV[1], ARGV[2])
+else
+    redis.call('RPUSH', KEYS[1], ARGV[1])
+end
+return 1
+"""
+
+class RedisWorkQueue:
+    """基于 Redis 的章节工作队列，多台机器上的 worker 共享同一个 job。
+
+    所有 key 都以 web2book:<job>: 为前缀。领取和失败重试用 Lua 脚本原子执行，
+    租约到期时间使用 Redis 服务器时间，不受各节点时钟偏差影响。
+    """
+
+    def __init__(self, redis_url='redis://localhost:6379/0', job='default', lease_seconds=180, max_attempts=3):
+        import redis
+        self.job = job
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.redis = redis.Redis.from_url(redis_url)
+        self.prefix = f"web2book:{job}:"
+        self._claim = self.redis.register_script(CLAIM_SCRIPT)
+        self._fail = self.redis.register_script(FAIL_SCRIPT)
+
+    def _key(self, name):
+        return self.prefix + name
+
+    def _queue_keys(self):
+        return [self._key('pending'), self._key('leases'), self._key('attempts'), self._key('failed')]
+
+    def reset(self):
+        """Delete everything stored for this job."""
+        keys = list(self.redis.scan_iter(match=self.prefix + '*'))
+        if keys:
+            self.redis.delete(*keys)
+
+    def set_config(self, config):
+        pipe = self.redis.pipeline()
+        pipe.set(self._key('config'), json.dumps(config, ensure_ascii=False))
+        pipe.delete(self._key('toc_closed'))
+        pipe.execute()
+
+    def get_config(self):
+        value = self.redis.get(self._key('config'))
+        return json.loads(value) if value else None
+
+    def publish(self, entries):
+        pipe = self.redis.pipeline()
+        for entry in entries:
+            pipe.hsetnx(self._key('entries'), entry['url'], json.dumps(entry, ensure_ascii=False))
+        added = pipe.execute()
+        urls = [entry['url'] for entry, new in zip(entries, added) if new]
+        if urls:
+            self.redis.rpush(self._key('pending'), *urls)
+
+    def close_toc(self):
+        self.redis.set(self._key('toc_closed'), 1)
+
+    def claim(self, worker_id):
+        url = self._claim(keys=self._queue_keys(), args=[self.lease_seconds, worker_id, self.max_attempts])
+        if not url:
+            return None
+        entry = self.redis.hget(self._key('entries'), url)
+        return json.loads(entry)
+
+    def complete(self, url, result, images=None):
+        pipe = self.redis.pipeline()
+        for name, data in (images or {}).items():
+            pipe.hsetnx(self._key('images'), name, data)
+        pipe.zrem(self._key('leases'), url)
+        pipe.hdel(self._key('failed'), url)
+        pipe.hset(self._key('results'), url, json.dumps(result, ensure_ascii=False))
+        pipe.execute()
+
+    def fail(self, url, error):
+        self._fail(keys=self._queue_keys(), args=[url, str(error), self.max_attempts])
+
+    def finished(self):
+        pipe = self.redis.pipeline()
+        pipe.get(self._key('toc_closed'))
+        pipe.llen(self._key('pending'))
+        pipe.zcard(self._key('leases'))
+        closed, pending, leased = pipe.execute()
+        return bool(closed) and pending == 0 and leased == 0
+
+    def status(self):
+        pipe = self.redis.pipeline()
+        pipe.llen(self._key('pending'))
+        pipe.zcard(self._key('leases'))
+        pipe.hlen(self._key('results'))
+        pipe.hlen(self._key('failed'))
+        pending, leased, done, failed = pipe.execute()
+        return {"pending": pending, "leased": leased, "done": done, "failed": failed}
+
+    def result(self, url):
+        value = self.redis.hget(self._key('results'), url)
+        return json.loads(value) if value else None
+
+    def failures(self):
+        return {url.decode(): error.decode() for url, error in self.redis.hgetall(self._key('failed')).items()}
+
+    def image(self, name):
+        return self.redis.hget(self._key('images'), name)
@@ -0,0 +1,81 @@
+import re
+from lxml import etree, html
+
+# 清理 remove_selectors 之后残留的脚本、样式等与正文无关的元素
+DROP_TAGS = ('script', 'style', 'noscript', 'template', 'link', 'meta', 'iframe')
+# 没有文字也没有子元素时可以整个删除的容器
+WRAPPER_TAGS = {'div', 'span', 'p', 'font', 'section', 'article', 'center', 'b', 'i', 'u', 'em', 'strong', 'small', 'big', 'a'}
+# 没有属性时只保留内容的内联标签
+UNWRAP_TAGS = {'span', 'font'}
+INVALID_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+def _collapse(text):
+    # 只压缩元素之间纯空白的文本，正文中的空白保持原样
+    if text is not None and not text.strip() and '\n' in text:
+        return '\n'
+    return text
+
+def _clean(element):
+    for child in list(element):
+        if not isinstance(child.tag, str):
+            # 注释和处理指令
+            child.drop_tree()
+            continue
+        if child.tag in DROP_TAGS:
+            child.drop_tree()
+            continue
+        _clean(child)
+        for name in list(child.attrib):
+            if name == 'style' or name.startswith('on'):
+                del child.attrib[name]
+        if child.tag in WRAPPER_TAGS and len(child) == 0 and not (child.text or '').strip() and child.get('id') is None:
+            child.drop_tree()
+        elif child.tag in UNWRAP_TAGS and not child.attrib:
+            child.drop_tag()
+    element.text = _collapse(element.text)
+    for child in element:
+        child.tail = _collapse(child.tail)
+
+def fragment():
+    """Return an empty container element that a parser backend copies its node tree into."""
+    return html.Element('div')
+
+def append_element(parent, tag, attrs):
+    """Append a copy of an element to parent and return it.
+
+    Returns None when the tag is not a valid XML name (e.g. Word's <o:p>); the caller then
+    copies its content into parent, as if the tag had been unwrapped.
+    """
+    try:
+        element = parent.makeelement(tag)
+    except ValueError:
+        return None
+    for name, value in attrs.items():
+        try:
+            element.set(name, INVALID_XML_CHARS.sub('', value or ''))
+        except ValueError:
+            # 不是合法 XML 名称的属性无法写进 XHTML，直接丢弃
+            pass
+    parent.append(element)
+    return element
+
+def append_text(parent, text):
+    text = INVALID_XML_CHARS.sub('', text)
+    if len(parent):
+        parent[-1].tail = (parent[-1].tail or '') + text
+    else:
+        parent.text = (parent.text or '') + text
+
+def compact_xhtml(container):
+    """Serialize a container built with fragment() as compact, well-formed XHTML.
+
+    Scripts, styles, comments, inline style and event attributes are removed, empty wrapper
+    elements are dropped and attribute-less <span>/<font> are unwrapped. Whitespace inside
+    text is kept as-is; no indentation is added.
+    """
+    if len(container) == 0 and not (container.text or '').strip():
+        return ''
+    _clean(container)
+    if len(container) == 1 and not (container.text or '').strip() and not (container[0].tail or '').strip():
+        return etree.tostring(container[0], method='xml', encoding='unicode', with_tail=False)
+    return etree.tostring(container, method='xml', encoding='unicode')